@@ -1,123 +1,1183 @@
 # app.py
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
-import matplotlib.pyplot as plt
-from io import BytesIO
-from datetime import datetime, date
+import argparse
+import functools
+import hashlib
+import json
+import multiprocessing
+import time
+import re
+import sys
+import tempfile
+import threading
+import unicodedata
+from dotenv import load_dotenv
+from openpyxl import Workbook
+from io import BytesIO, StringIO
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+try:
+    import fcntl  # bloqueo entre procesos; no existe en Windows
+except ImportError:
+    fcntl = None
+
+# Importado o desde la línea de comandos no hay Streamlit en marcha: sus avisos de "modo desnudo"
+# por cada caché solo ensucian la salida. Leer la configuración antes evita que al cargarla
+# después vuelva a fijar el nivel de los logs.
+if not st.runtime.exists():
+    from streamlit.logger import set_log_level
+    st.get_option("logger.level")
+    set_log_level("error")
 
 # === 🖼️ Metaetiquetas para vista previa en redes sociales (WhatsApp, LinkedIn, etc.) ===
 preview_image_url = "https://raw.githubusercontent.com/lfdomc/Repuestos-APP-PYTHON/main/preview.png"
 app_url = "https://repuestos-app-python-p96bvhkf58pm9yuujw5rha.streamlit.app/"
 
-st.markdown(f"""
+METAETIQUETAS = f"""
     <meta property="og:title" content="🏥 Dashboard de Gestión Técnica - Laboratorio">
     <meta property="og:description" content="Indicadores de confiabilidad de equipos médicos y análisis inteligente de repuestos críticos.">
     <meta property="og:image" content="{preview_image_url}">
     <meta property="og:url" content="{app_url}">
     <meta property="og:type" content="website">
     <meta name="twitter:card" content="summary_large_image">
-""", unsafe_allow_html=True)
+"""
 
 # === 🎨 Configuración de la página ===
-st.set_page_config(
-    page_title="📊 Indicadores Técnicos - Laboratorio",
-    page_icon="🏥",
-    layout="wide"
-)
+# Se aplica al iniciar la interfaz; importar este módulo no dibuja nada (ver interfaz())
+CONFIG_PAGINA = {
+    'page_title': "📊 Indicadores Técnicos - Laboratorio",
+    'page_icon': "🏥",
+    'layout': "wide",
+}
+
+# === ⏱️ Instrumentación de consultas, cargas y reruns ===
+# Se mide cada consulta SQL, cada cálculo de carga, exportación y gráfico, y cada ejecución de
+# una sección; las cachés cuentan aciertos y fallos. Las cifras se ven en un panel de
+# administración opcional y se exportan en formato Prometheus o JSON Lines. Cada parámetro se
+# puede fijar en secrets ([metricas]) o con la variable METRICAS_<NOMBRE>.
+METRICAS_CONFIG_POR_DEFECTO = {
+    'panel': False,         # muestra el panel en la barra lateral
+    'prometheus': "",       # archivo para el textfile collector de node_exporter
+    'jsonl': "",            # archivo al que se agrega una línea por métrica
+    'intervalo': 60,        # segundos mínimos entre escrituras de los archivos
+}
+# Duraciones recientes que se guardan por operación para calcular los percentiles
+METRICAS_MUESTRAS = 1_000
+
+def _config_metricas(clave):
+    return _config("metricas", clave, METRICAS_CONFIG_POR_DEFECTO[clave])
+
+@st.cache_resource
+def _metricas_tiempos():
+    """Duraciones y contadores por operación, compartidos entre sesiones."""
+    return {'tiempos': {}, 'cache': {}, 'lock': threading.Lock(), 'exportado': 0.0,
+            'local': threading.local()}
+
+def registrar_duracion(tipo, nombre, ms):
+    """Anota que la operación (`tipo`, `nombre`) tardó `ms` milisegundos."""
+    metricas = _metricas_tiempos()
+    with metricas['lock']:
+        tiempo = metricas['tiempos'].get((tipo, nombre))
+        if tiempo is None:
+            tiempo = metricas['tiempos'][(tipo, nombre)] = {
+                'ms': deque(maxlen=METRICAS_MUESTRAS), 'cantidad': 0, 'total_ms': 0.0
+            }
+        tiempo['ms'].append(ms)
+        tiempo['cantidad'] += 1
+        tiempo['total_ms'] += ms
+
+def contar_cache(tipo, nombre, resultado):
+    """Suma un acierto o un fallo (`resultado`) a la caché de (`tipo`, `nombre`)."""
+    metricas = _metricas_tiempos()
+    with metricas['lock']:
+        clave = (tipo, nombre, resultado)
+        metricas['cache'][clave] = metricas['cache'].get(clave, 0) + 1
+
+@contextmanager
+def medir(tipo, nombre):
+    """Mide el bloque `with` bajo (`tipo`, `nombre`)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_duracion(tipo, nombre, (time.perf_counter() - inicio) * 1000)
+
+def medido(tipo):
+    """Decorador que mide cada llamada a la función bajo (`tipo`, nombre de la función)."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with medir(tipo, funcion.__name__):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+def cacheada(tipo, cache=st.cache_data, **opciones):
+    """Como `cache(**opciones)`, pero cuenta aciertos y fallos y mide el cálculo en cada fallo.
+
+    La función resultante conserva `.clear()`.
+    """
+    def decorador(funcion):
+        nombre = funcion.__name__
+        
+        @functools.wraps(funcion)
+        def calcular(*args, **kwargs):
+            # Solo se ejecuta cuando la caché no tiene el resultado
+            _metricas_tiempos()['local'].llamadas[-1] = True
+            with medir(tipo, nombre):
+                return funcion(*args, **kwargs)
+        
+        en_cache = cache(**opciones)(calcular)
+        
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            local = _metricas_tiempos()['local']
+            if not hasattr(local, 'llamadas'):
+                local.llamadas = []
+            local.llamadas.append(False)  # pila: una carga puede llamar a otra
+            try:
+                return en_cache(*args, **kwargs)
+            finally:
+                contar_cache(tipo, nombre, 'fallo' if local.llamadas.pop() else 'acierto')
+        
+        envoltura.clear = en_cache.clear
+        return envoltura
+    return decorador
+
+def _resumen_metricas():
+    """Filas con percentiles de cada operación y aciertos de cada caché, para mostrar o exportar."""
+    metricas = _metricas_tiempos()
+    with metricas['lock']:
+        tiempos = {clave: (np.array(t['ms']), t['cantidad'], t['total_ms'])
+                   for clave, t in metricas['tiempos'].items()}
+        cache = dict(metricas['cache'])
+    operaciones = []
+    for (tipo, nombre), (muestras, cantidad, total_ms) in sorted(tiempos.items()):
+        p50, p95, p99 = np.percentile(muestras, [50, 95, 99])
+        operaciones.append({'tipo': tipo, 'nombre': nombre, 'cantidad': cantidad, 'total_ms': total_ms,
+                            'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': muestras.max()})
+    caches = []
+    for tipo, nombre in sorted({(tipo, nombre) for tipo, nombre, _ in cache}):
+        aciertos, fallos = cache.get((tipo, nombre, 'acierto'), 0), cache.get((tipo, nombre, 'fallo'), 0)
+        caches.append({'tipo': tipo, 'nombre': nombre, 'aciertos': aciertos, 'fallos': fallos})
+    return operaciones, caches
+
+def _etiquetas(**etiquetas):
+    valores = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in etiquetas.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(etiquetas, valores)) + "}"
+
+def metricas_prometheus():
+    """Métricas en el formato de texto de Prometheus."""
+    operaciones, caches = _resumen_metricas()
+    lineas = [
+        "# HELP repuestos_duracion_segundos Duración de consultas, cargas, exportaciones, gráficos y secciones.",
+        "# TYPE repuestos_duracion_segundos summary",
+    ]
+    for op in operaciones:
+        for cuantil, columna in (("0.5", 'p50_ms'), ("0.95", 'p95_ms'), ("0.99", 'p99_ms')):
+            etiquetas = _etiquetas(tipo=op['tipo'], nombre=op['nombre'], quantile=cuantil)
+            lineas.append(f"repuestos_duracion_segundos{etiquetas} {op[columna] / 1000:.6f}")
+        etiquetas = _etiquetas(tipo=op['tipo'], nombre=op['nombre'])
+        lineas.append(f"repuestos_duracion_segundos_sum{etiquetas} {op['total_ms'] / 1000:.6f}")
+        lineas.append(f"repuestos_duracion_segundos_count{etiquetas} {op['cantidad']}")
+    lineas += [
+        "# HELP repuestos_cache_total Llamadas a funciones cacheadas según si la caché tenía el resultado.",
+        "# TYPE repuestos_cache_total counter",
+    ]
+    for c in caches:
+        for resultado in ('acierto', 'fallo'):
+            etiquetas = _etiquetas(tipo=c['tipo'], nombre=c['nombre'], resultado=resultado)
+            lineas.append(f"repuestos_cache_total{etiquetas} {c[resultado + 's']}")
+    return "\n".join(lineas) + "\n"
+
+def metricas_jsonl():
+    """Métricas como JSON Lines: una línea por operación y por caché, con la hora de la medición."""
+    operaciones, caches = _resumen_metricas()
+    instante = datetime.now().isoformat(timespec='seconds')
+    lineas = [json.dumps({'instante': instante, 'metrica': 'duracion', **op}, default=float) for op in operaciones]
+    lineas += [json.dumps({'instante': instante, 'metrica': 'cache', **c}) for c in caches]
+    return "".join(linea + "\n" for linea in lineas)
+
+def exportar_metricas_archivos():
+    """Escribe los archivos de métricas configurados, como mucho una vez cada `intervalo` segundos."""
+    prometheus, jsonl = _config_metricas('prometheus'), _config_metricas('jsonl')
+    if not prometheus and not jsonl:
+        return
+    metricas = _metricas_tiempos()
+    with metricas['lock']:
+        if time.time() - metricas['exportado'] < float(_config_metricas('intervalo')):
+            return
+        metricas['exportado'] = time.time()
+    try:
+        if prometheus:
+            temporal = f"{prometheus}.{os.getpid()}.tmp"
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                archivo.write(metricas_prometheus())
+            os.replace(temporal, prometheus)  # el colector nunca lee un archivo a medias
+        if jsonl:
+            with open(jsonl, "a", encoding="utf-8") as archivo:
+                archivo.write(metricas_jsonl())
+    except OSError as e:
+        st.sidebar.warning(f"⚠️ No se pudieron escribir las métricas: {e}")
+
+def panel_metricas():
+    """Panel de administración con los tiempos y las cachés; solo si [metricas] panel está activo."""
+    if not _config_metricas('panel'):
+        return
+    operaciones, caches = _resumen_metricas()
+    with st.sidebar.expander("⏱️ Métricas de rendimiento"):
+        if operaciones:
+            tabla = pd.DataFrame(operaciones)
+            st.dataframe(
+                tabla[['tipo', 'nombre', 'cantidad', 'p50_ms', 'p95_ms', 'max_ms']].round(1)
+                .sort_values('p95_ms', ascending=False),
+                hide_index=True
+            )
+        if caches:
+            tabla = pd.DataFrame(caches)
+            tabla['% aciertos'] = (100 * tabla['aciertos'] / (tabla['aciertos'] + tabla['fallos'])).round(1)
+            st.dataframe(tabla, hide_index=True)
+        col1, col2 = st.columns(2)
+        col1.download_button("Prometheus", metricas_prometheus(), file_name="repuestos_metricas.prom",
+                             mime="text/plain", key="metricas_prometheus")
+        col2.download_button("JSON Lines", metricas_jsonl(), file_name="repuestos_metricas.jsonl",
+                             mime="application/jsonl", key="metricas_jsonl")
 
 # === 🔌 Conexión segura a la base de datos ===
+# Parámetros del pool; cada uno se puede fijar en secrets ([db]) o con la variable DB_<NOMBRE>
+DB_CONFIG_POR_DEFECTO = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True,
+    'statement_timeout_ms': 30_000,
+}
+
+# Tiempo máximo por consulta (ms) de las cargas que difieren del valor general.
+# Se puede sobrescribir con [db.timeouts] en secrets o DB_TIMEOUTS='{"carga": ms}'.
+TIMEOUTS_CONSULTA_MS = {
+    'cargar_datos_maestros': 10_000,
+    'cargar_analisis_stock': 60_000,
+    'consultar_costos': 60_000,
+    'cargar_indicadores_equipos': 60_000,
+}
+
+# .env se lee una sola vez, al importar; no pisa las variables que ya existen en el entorno
+load_dotenv()
+
+@functools.lru_cache(maxsize=None)
+def _secretos(seccion):
+    """st.secrets[seccion], leído una sola vez; vacío si no hay secrets.toml o no tiene la sección."""
+    try:
+        return st.secrets[seccion]
+    except (KeyError, FileNotFoundError):
+        return {}
+
+def _config(seccion, clave, por_defecto):
+    """Lee un parámetro de st.secrets[seccion] o, si no está, de la variable <SECCION>_<CLAVE>."""
+    secretos = _secretos(seccion)
+    if clave in secretos:
+        return secretos[clave]
+    valor = os.getenv(f"{seccion.upper()}_{clave.upper()}")
+    if valor is None:
+        return por_defecto
+    if isinstance(por_defecto, bool):
+        return valor.strip().lower() in ("1", "true", "yes", "si", "sí")
+    if isinstance(por_defecto, dict):
+        return json.loads(valor)
+    return type(por_defecto)(valor)
+
+def _config_db(clave, por_defecto):
+    """Lee un parámetro de st.secrets["db"] o, si no está, de la variable de entorno DB_<CLAVE>."""
+    return _config("db", clave, por_defecto)
+
+@st.cache_resource
+def _metricas_pool():
+    """Contadores del pool de conexiones, compartidos entre sesiones."""
+    return {
+        'esperas_ms': deque(maxlen=500),
+        'conexiones_nuevas': 0,
+        'invalidadas': 0,
+        'pool_agotado': 0,
+    }
+
+# Host de la base de datos de producción
+HOST_PRODUCCION = "repuestos-lfdomc-bc58.i.aivencloud.com"
+
 @st.cache_resource
 def init_connection():
-    try:
-        db_password = st.secrets["db"]["password"]
-    except KeyError:
-        from dotenv import load_dotenv
-        load_dotenv()
-        db_password = os.getenv("DB_PASSWORD")
+    # `url` en [db] o DB_URL apunta a otra base de datos, p. ej. una local de desarrollo
+    url = _config_db('url', "")
+    if not url:
+        db_password = _config_db('password', "")
         if not db_password:
-            st.error("❌ No se encontró la contraseña de la base de datos. Configura 'DB_PASSWORD' en secrets o .env")
+            mensaje = ("No se encontró la contraseña de la base de datos. Configura 'password' en [db] "
+                       "de secrets, DB_PASSWORD en el entorno o .env, o DB_URL con otra base de datos")
+            if not st.runtime.exists():
+                # Sin Streamlit, st.error y st.stop no hacen nada: se seguiría con la contraseña 'None'
+                raise RuntimeError(mensaje)
+            st.error(f"❌ {mensaje}")
             st.stop()
+        url = f"postgresql+psycopg2://avnadmin:{db_password}@{HOST_PRODUCCION}:27168/defaultdb"
+    return crear_engine(url)
 
+def crear_engine(url):
+    """Engine de `url` con el pool de [db] y las métricas de conexiones y consultas."""
+    config = {clave: _config_db(clave, valor) for clave, valor in DB_CONFIG_POR_DEFECTO.items()}
     engine = create_engine(
-        f"postgresql://avnadmin:{db_password}@"
-        "repuestos-lfdomc-bc58.i.aivencloud.com:27168/defaultdb"
+        url,
+        pool_size=int(config['pool_size']),
+        max_overflow=int(config['max_overflow']),
+        pool_timeout=float(config['pool_timeout']),
+        pool_recycle=int(config['pool_recycle']),
+        pool_pre_ping=bool(config['pool_pre_ping']),
+        connect_args={"options": f"-c statement_timeout={int(config['statement_timeout_ms'])}"}
     )
+    
+    metricas = _metricas_pool()
+    
+    @event.listens_for(engine.pool, "connect")
+    def _al_conectar(dbapi_connection, connection_record):
+        metricas['conexiones_nuevas'] += 1
+    
+    @event.listens_for(engine.pool, "invalidate")
+    def _al_invalidar(dbapi_connection, connection_record, exception):
+        metricas['invalidadas'] += 1
+    
+    # Tiempo de cada consulta, etiquetado con la carga que abrió la conexión (ver conexion_lectura)
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+        context.inicio_consulta = time.perf_counter()
+    
+    @event.listens_for(engine, "after_cursor_execute")
+    def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+        inicio = getattr(context, 'inicio_consulta', None)
+        if inicio is not None:
+            registrar_duracion('sql', conn.info.get('carga', 'otras'), (time.perf_counter() - inicio) * 1000)
+    
     return engine
 
-engine = init_connection()
+try:
+    engine = init_connection()
+except RuntimeError:
+    # Importado sin credenciales (tests, benchmark con su propia URL): no hay engine hasta que quien
+    # importa asigne app.engine; `python app.py` vuelve a pedirlo y muestra qué falta configurar
+    engine = None
+
+@contextmanager
+def conexion_lectura(carga):
+    """Conexión del pool con el statement_timeout que corresponde a la carga `carga`.
+
+    Registra cuánto se esperó para obtener la conexión, para el panel de diagnóstico.
+    """
+    metricas = _metricas_pool()
+    inicio = time.perf_counter()
+    try:
+        conn = engine.connect()
+    except PoolTimeoutError:
+        metricas['pool_agotado'] += 1
+        raise
+    metricas['esperas_ms'].append((time.perf_counter() - inicio) * 1000)
+    
+    with conn:
+        conn.info['carga'] = carga
+        try:
+            timeouts = {**TIMEOUTS_CONSULTA_MS, **_config_db('timeouts', {})}
+            if carga in timeouts:
+                conn.execute(text(f"SET LOCAL statement_timeout = {int(timeouts[carga])}"))
+            yield conn
+        finally:
+            conn.info.pop('carga', None)
+
+@st.cache_resource
+def _ejecutor_consultas():
+    """Hilos para consultas simultáneas; no más que conexiones fijas tiene el pool."""
+    return ThreadPoolExecutor(
+        max_workers=int(_config_db('pool_size', DB_CONFIG_POR_DEFECTO['pool_size'])),
+        thread_name_prefix="consultas"
+    )
+
+def leer_en_paralelo(carga, consultas):
+    """Ejecuta consultas independientes, cada una en su propia conexión del pool.
+
+    `consultas` es {nombre: sql} y se devuelve {nombre: DataFrame}. Como las consultas viajan a
+    la vez, la carga tarda lo que la más lenta y no la suma de todas.
+    """
+    def leer(sql):
+        with conexion_lectura(carga) as conn:
+            return pd.read_sql(sql, conn)
+    
+    ejecutor = _ejecutor_consultas()
+    futuros = {nombre: ejecutor.submit(leer, sql) for nombre, sql in consultas.items()}
+    return {nombre: futuro.result() for nombre, futuro in futuros.items()}
+
+def panel_diagnostico_conexiones():
+    """Muestra en la barra lateral el estado del pool y los tiempos de espera por conexión."""
+    metricas = _metricas_pool()
+    esperas = np.array(metricas['esperas_ms'])
+    with st.sidebar.expander("🔌 Diagnóstico de conexiones"):
+        col1, col2 = st.columns(2)
+        col1.metric("En uso", engine.pool.checkedout())
+        col2.metric("Libres", engine.pool.checkedin())
+        col1.metric("Desborde", max(engine.pool.overflow(), 0))
+        col2.metric("Pool agotado", metricas['pool_agotado'])
+        col1.metric("Espera media", f"{esperas.mean():.1f} ms" if esperas.size else "—")
+        col2.metric("Espera p95", f"{np.percentile(esperas, 95):.1f} ms" if esperas.size else "—")
+        st.caption(
+            f"Conexiones abiertas: {metricas['conexiones_nuevas']} • "
+            f"Invalidadas: {metricas['invalidadas']} • {engine.pool.status()}"
+        )
+
+# === 🔄 Versiones de tablas para invalidar cachés ===
+# Cada escritura de la app incrementa, en la misma transacción, la versión de las tablas que
+# toca. Las versiones viven en la base de datos, así que todas las réplicas las ven; cada carga
+# declara qué tablas lee y solo se descarta cuando alguna de ellas cambió. Por eso las cargas
+# pueden cachearse por horas sin mostrar datos viejos después de una escritura propia.
+TTL_CARGAS = 4 * 3600
+# Cada cuánto se consulta si otra réplica escribió (segundos)
+VERSIONES_INTERVALO = 5
+
+TABLAS_COSTOS = ('servicios_tecnicos', 'consumo_repuestos', 'catalogo_repuestos',
+                 'tecnicos', 'equipos_instalados', 'clientes')
+TABLAS_POR_CARGA = {
+    'cargar_datos_maestros': ('tecnicos', 'equipos_instalados', 'modelos', 'clientes',
+                              'catalogo_repuestos', 'contratos'),
+    'cargar_indices_busqueda': ('equipos_instalados', 'modelos', 'clientes', 'catalogo_repuestos'),
+    'cargar_analisis_stock': ('catalogo_repuestos', 'inventario_logistico', 'politica_stock_repuestos',
+                              'equipos_instalados', 'compatibilidad', 'modelos'),
+    'cargar_opciones_costos': ('tecnicos', 'servicios_tecnicos'),
+    'cargar_resumen_costos': TABLAS_COSTOS + ('costos_mensuales', 'consumo_mensual'),
+    'cargar_pagina_costos': TABLAS_COSTOS,
+    'exportar_costos': TABLAS_COSTOS,
+    'cargar_indicadores_equipos': ('equipos_instalados', 'modelos', 'clientes', 'confiabilidad_equipos'),
+    'cargar_historial_consumo': ('consumo_repuestos', 'servicios_tecnicos', 'equipos_instalados',
+                                 'catalogo_repuestos', 'inventario_logistico'),
+    'planificar_reposicion': ('consumo_repuestos', 'servicios_tecnicos', 'equipos_instalados', 'modelos',
+                              'clientes', 'catalogo_repuestos', 'inventario_logistico',
+                              'politica_stock_repuestos', 'compatibilidad', 'confiabilidad_equipos'),
+}
+
+SQL_INCREMENTAR_VERSIONES = """
+    INSERT INTO versiones_tablas (tabla, version)
+    SELECT unnest(CAST(:tablas_modificadas AS text[])), 1 {origen}
+    ON CONFLICT (tabla) DO UPDATE SET version = versiones_tablas.version + 1, actualizado = now()
+"""
+
+@st.cache_resource
+def preparar_versiones_tablas():
+    """Crea (si falta) la tabla donde se llevan las versiones de cada tabla."""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS versiones_tablas (
+                tabla TEXT PRIMARY KEY,
+                version BIGINT NOT NULL,
+                actualizado TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+    return "versiones_tablas"
+
+def incrementar_versiones(conn, tablas):
+    """Incrementa la versión de `tablas` dentro de la transacción de `conn`."""
+    preparar_versiones_tablas()
+    conn.execute(text(SQL_INCREMENTAR_VERSIONES.format(origen="")),
+                 {'tablas_modificadas': list(tablas)})
+
+@st.cache_data(ttl=VERSIONES_INTERVALO, show_spinner=False)
+def leer_versiones_tablas():
+    """Versión actual de cada tabla que alguna vez se modificó desde la app."""
+    preparar_versiones_tablas()
+    with conexion_lectura('leer_versiones_tablas') as conn:
+        filas = conn.execute(text("SELECT tabla, version FROM versiones_tablas")).all()
+    return dict(filas)
+
+@st.cache_resource
+def _versiones_vistas():
+    """Versiones con que se llenaron las cachés de este proceso."""
+    return {'versiones': None, 'lock': threading.Lock()}
+
+def versiones_de(carga):
+    """Versiones actuales de las tablas que lee `carga`, como tupla apta para una clave de caché."""
+    versiones = leer_versiones_tablas()
+    return tuple((tabla, versiones.get(tabla, 0)) for tabla in TABLAS_POR_CARGA[carga])
+
+def sincronizar_caches():
+    """Descarta las cachés cuyas tablas cambiaron desde la última sincronización de este proceso."""
+    vistas = _versiones_vistas()
+    actuales = leer_versiones_tablas()
+    with vistas['lock']:
+        previas, vistas['versiones'] = vistas['versiones'], actuales
+    if previas is None or previas == actuales:
+        return
+    cambiadas = {tabla for tabla in actuales.keys() | previas.keys()
+                 if actuales.get(tabla) != previas.get(tabla)}
+    for carga, tablas in TABLAS_POR_CARGA.items():
+        if cambiadas.intersection(tablas):
+            globals()[carga].clear()
+
+def avisar_escritura():
+    """Tras confirmar una escritura propia: las versiones se releen en el próximo rerun, sin esperar."""
+    leer_versiones_tablas.clear()
+
+# === 🗄️ Caché persistente de instantáneas ===
+# Las cargas pesadas se guardan como archivos Arrow en un directorio compartido por reinicios y
+# réplicas (un volumen común, o /dev/shm para tenerlas en memoria compartida). Se leen con
+# memory-map, así un proceso recién iniciado arranca caliente sin consultar la base de datos.
+# Cada parámetro se puede fijar en secrets ([cache]) o con la variable CACHE_<NOMBRE>.
+CACHE_CONFIG_POR_DEFECTO = {
+    'dir': os.path.join(tempfile.gettempdir(), "repuestos_cache"),
+    'max_mb': 512,
+    'ttl': TTL_CARGAS,
+    # Vigencia de las instantáneas que deja el precálculo nocturno: hasta la noche siguiente
+    'ttl_precalculo': 26 * 3600,
+}
+
+# Forma parte de cada clave: instantáneas escritas por otra versión de pyarrow/pandas se ignoran
+VERSION_INSTANTANEAS = f"1-pa{pa.__version__.split('.')[0]}-pd{pd.__version__.split('.')[0]}"
+
+# Los textos vuelven como texto de Arrow, igual que los deja compactar_tipos
+TIPOS_ARROW_A_PANDAS = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+
+def _config_cache(clave):
+    return _config("cache", clave, CACHE_CONFIG_POR_DEFECTO[clave])
+
+def _huella_clave(valor):
+    return hashlib.sha256(repr(valor).encode()).hexdigest()[:16]
+
+def _ruta_instantanea(nombre, version, args=(), versiones=()):
+    """Ruta del archivo de una carga: una huella de la versión de la carga y sus argumentos, y otra
+    de las versiones de las tablas que lee."""
+    clave = _huella_clave((VERSION_INSTANTANEAS, version, args))
+    return os.path.join(_config_cache('dir'), f"{nombre}-v{version}-{clave}-{_huella_clave(versiones)}.arrow")
+
+def _borrar_reemplazadas(ruta):
+    """Borra las instantáneas de la misma carga y argumentos con otras versiones de las tablas."""
+    prefijo = os.path.basename(ruta).rsplit('-', 1)[0] + '-'
+    with suppress(OSError), os.scandir(os.path.dirname(ruta)) as entradas:
+        for entrada in entradas:
+            if entrada.name.startswith(prefijo) and entrada.name.endswith('.arrow') and entrada.path != ruta:
+                with suppress(OSError):
+                    os.remove(entrada.path)
+
+def leer_instantanea(ruta, ttl=None):
+    """Devuelve el DataFrame guardado en `ruta`, o None si no existe, venció o no se puede leer.
+
+    Si el archivo se escribió con su propia vigencia, esta reemplaza a `ttl`.
+    """
+    try:
+        with pa.memory_map(ruta) as fuente:
+            lector = pa.ipc.open_file(fuente)
+            creado = float(lector.schema.metadata[b'creado'])
+            if ttl is not None and b'vigencia' in lector.schema.metadata:
+                ttl = float(lector.schema.metadata[b'vigencia'])
+            if ttl is not None and time.time() - creado > ttl:
+                return None
+            df = lector.read_all().to_pandas(types_mapper=TIPOS_ARROW_A_PANDAS.get)
+        os.utime(ruta)  # la fecha de modificación marca el último uso para el LRU
+    except (OSError, KeyError, TypeError, ValueError, pa.ArrowException):
+        return None
+    return df
+
+def escribir_instantanea(ruta, df, vigencia=None):
+    """Guarda `df` en `ruta` de forma atómica y recorta el directorio al tamaño máximo.
+
+    `vigencia` (segundos) reemplaza al ttl de los lectores para este archivo.
+    """
+    try:
+        tabla = pa.Table.from_pandas(df)
+    except (TypeError, ValueError, pa.ArrowException):
+        return False  # columnas que Arrow no representa: queda solo la caché en memoria
+    metadatos = {b'creado': str(time.time()).encode()}
+    if vigencia is not None:
+        metadatos[b'vigencia'] = str(float(vigencia)).encode()
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), **metadatos})
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with pa.OSFile(temporal, 'wb') as destino, pa.ipc.new_file(destino, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+        os.replace(temporal, ruta)
+    except OSError:
+        with suppress(OSError):
+            os.remove(temporal)
+        return False
+    _borrar_reemplazadas(ruta)
+    _recortar_instantaneas()
+    return True
+
+def _recortar_instantaneas():
+    """Borra las instantáneas usadas hace más tiempo hasta quedar bajo `max_mb`."""
+    archivos = []
+    with suppress(OSError), os.scandir(_config_cache('dir')) as entradas:
+        for entrada in entradas:
+            if entrada.name.endswith('.arrow.lock'):
+                # Bloqueos por instantánea de versiones anteriores: ya no los usa nadie
+                with suppress(OSError):
+                    os.remove(entrada.path)
+            elif entrada.name.endswith('.arrow'):
+                with suppress(OSError):
+                    estado = entrada.stat()
+                    archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+    sobrante = sum(tamano for _, tamano, _ in archivos) - float(_config_cache('max_mb')) * 2**20
+    for _, tamano, ruta in sorted(archivos):
+        if sobrante <= 0:
+            break
+        with suppress(OSError):
+            os.remove(ruta)
+        sobrante -= tamano
+
+def borrar_instantaneas(nombre):
+    """Elimina todas las instantáneas de una carga, de cualquier versión o argumentos."""
+    with suppress(OSError), os.scandir(_config_cache('dir')) as entradas:
+        for entrada in entradas:
+            if entrada.name.startswith(f"{nombre}-v") and entrada.name.endswith('.arrow'):
+                with suppress(OSError):
+                    os.remove(entrada.path)
+
+@contextmanager
+def _bloqueo_instantanea(nombre):
+    """Bloqueo entre procesos para que una sola réplica recalcule cada carga.
 
-# === 📥 Función para crear archivo Excel en memoria ===
+    Hay un archivo de bloqueo por carga, no por instantánea: así no se acumulan con cada versión.
+    """
+    if fcntl is None:
+        yield
+        return
+    directorio = _config_cache('dir')
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, f"{nombre}.lock"), "w") as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+# Cargas cuya instantánea puede calcularse sin interfaz: {nombre de la carga: función que la
+# recalcula y la escribe}. Lo llena instantanea_disco.
+PRECALCULABLES = {}
+
+def instantanea_disco(nombre, version=1):
+    """Decorador para cargas que devuelven un DataFrame: reutiliza la instantánea en disco mientras
+    tenga menos de `ttl` segundos y las tablas que lee la carga no hayan cambiado de versión.
+    Hay que subir `version` cuando cambian las columnas o el cálculo.
+    """
+    def decorador(carga):
+        def precalcular():
+            """Recalcula la carga aunque haya instantánea y la deja escrita hasta el próximo precálculo."""
+            ruta = _ruta_instantanea(nombre, version, (), versiones_de(carga.__name__))
+            with _bloqueo_instantanea(nombre):
+                df = carga()
+                escribir_instantanea(ruta, df, vigencia=float(_config_cache('ttl_precalculo')))
+            return df
+        PRECALCULABLES[carga.__name__] = precalcular
+        
+        @functools.wraps(carga)
+        def envoltura(*args):
+            ruta = _ruta_instantanea(nombre, version, args, versiones_de(carga.__name__))
+            ttl = float(_config_cache('ttl'))
+            df = leer_instantanea(ruta, ttl)
+            if df is not None:
+                registrar_memoria(carga.__name__, df)
+                contar_cache('instantanea', nombre, 'acierto')
+                return df
+            with _bloqueo_instantanea(nombre):
+                # Otra réplica pudo escribirla mientras se esperaba el bloqueo
+                df = leer_instantanea(ruta, ttl)
+                if df is None:
+                    df = carga(*args)
+                    escribir_instantanea(ruta, df)
+                    contar_cache('instantanea', nombre, 'fallo')
+                else:
+                    registrar_memoria(carga.__name__, df)
+                    contar_cache('instantanea', nombre, 'acierto')
+            return df
+        return envoltura
+    return decorador
+
+# === 🧠 Tipos compactos y memoria de las cachés ===
+# Máxima proporción de valores distintos para guardar una columna de texto como categoría
+COMPACTAR_MAX_UNICOS = 0.5
+
+def memoria_df(df):
+    """Bytes que ocupa `df`, contando el contenido de los textos."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+@st.cache_resource
+def _memoria_caches():
+    """Tamaño del último resultado de cada carga en este proceso."""
+    return {}
+
+def registrar_memoria(carga, df, bytes_sin_compactar=None):
+    """Anota filas y memoria del resultado de `carga` para el panel de memoria."""
+    registro = _memoria_caches()
+    if bytes_sin_compactar is None:
+        bytes_sin_compactar = registro.get(carga, {}).get('bytes_sin_compactar')
+    registro[carga] = {'filas': len(df), 'bytes': memoria_df(df),
+                       'bytes_sin_compactar': bytes_sin_compactar}
+
+def compactar_tipos(df, carga=None):
+    """Pasa `df` a tipos compactos y, si se indica `carga`, registra su memoria antes y después.
+
+    Los textos repetidos quedan como categoría y el resto como texto de Arrow. Las fechas pasan a
+    datetime64 y los enteros al tipo más chico que los contiene. Los float no se tocan: son montos.
+    """
+    antes = memoria_df(df) if carga is not None else None
+    columnas = {}
+    for col, serie in df.items():
+        if serie.dtype == object:
+            tipo = pd.api.types.infer_dtype(serie, skipna=True)
+            if tipo == 'string' or (tipo == 'empty' and len(serie)):
+                repetida = serie.nunique() <= COMPACTAR_MAX_UNICOS * len(serie)
+                columnas[col] = serie.astype('category' if repetida and tipo == 'string' else 'string[pyarrow]')
+            elif tipo in ('date', 'datetime'):
+                columnas[col] = pd.to_datetime(serie)
+        elif pd.api.types.is_integer_dtype(serie.dtype):
+            columnas[col] = pd.to_numeric(serie, downcast='integer')
+    df = df.assign(**columnas)
+    if carga is not None:
+        registrar_memoria(carga, df, antes)
+    return df
+
+def panel_memoria_caches():
+    """Muestra en la barra lateral cuánta memoria ocupa el resultado de cada carga."""
+    registro = _memoria_caches()
+    if not registro:
+        return
+    with st.sidebar.expander("🧠 Memoria de cachés"):
+        filas = []
+        for carga, datos in sorted(registro.items()):
+            sin_compactar = datos['bytes_sin_compactar']
+            filas.append({
+                'Carga': carga.replace('cargar_', ''),
+                'Filas': datos['filas'],
+                'MB': round(datos['bytes'] / 2**20, 2),
+                'MB sin compactar': round(sin_compactar / 2**20, 2) if sin_compactar else None,
+            })
+        st.dataframe(pd.DataFrame(filas), hide_index=True)
+        st.caption(f"Total: {sum(d['bytes'] for d in registro.values()) / 2**20:.1f} MB por copia")
+
+# === 📥 Exportación de tablas bajo demanda ===
+EXPORTACION_FILAS_POR_BLOQUE = 10_000
+
+def _como_bloques(datos, tamano=EXPORTACION_FILAS_POR_BLOQUE):
+    """Recorre un DataFrame en bloques de filas; un iterable de DataFrames se devuelve tal cual."""
+    if isinstance(datos, pd.DataFrame):
+        for inicio in range(0, max(len(datos), 1), tamano):
+            yield datos.iloc[inicio:inicio + tamano]
+    else:
+        yield from datos
+
+@medido('exportacion')
 def to_excel(df_dict):
+    """Crea un archivo Excel en memoria con una hoja por DataFrame o iterable de bloques.
+
+    Usa el modo de solo escritura de openpyxl, que vuelca las filas a medida que llegan
+    en lugar de mantener un objeto por celda.
+    """
+    libro = Workbook(write_only=True)
+    for sheet_name, datos in df_dict.items():
+        hoja = libro.create_sheet(sheet_name)
+        for i, bloque in enumerate(_como_bloques(datos)):
+            if i == 0:
+                hoja.append([str(col) for col in bloque.columns])
+            for fila in bloque.astype(object).where(bloque.notna(), None).itertuples(index=False, name=None):
+                hoja.append(fila)
+    output = BytesIO()
+    libro.save(output)
+    return output.getvalue()
+
+@medido('exportacion')
+def to_csv(df_dict):
+    """Crea un CSV en memoria con el primer DataFrame o iterable de bloques de `df_dict`."""
+    output = BytesIO()
+    for i, bloque in enumerate(_como_bloques(next(iter(df_dict.values())))):
+        bloque.to_csv(output, index=False, header=(i == 0), encoding='utf-8')
+    return output.getvalue()
+
+def _decimales_a_float(bloque):
+    """Pasa a float64 las columnas de Decimal (NUMERIC en PostgreSQL).
+
+    Arrow infiere la escala de cada bloque a partir de sus valores, así que dos bloques de la misma
+    columna pueden no tener el mismo tipo y el segundo no cabe en el esquema del primero.
+    """
+    tipos = {}
+    for col in bloque.select_dtypes(include='object').columns:
+        primero = bloque[col].dropna().head(1)
+        if len(primero) and isinstance(primero.iloc[0], Decimal):
+            tipos[col] = 'float64'
+    return bloque.astype(tipos) if tipos else bloque
+
+@medido('exportacion')
+def to_parquet(df_dict):
+    """Crea un Parquet en memoria con el primer DataFrame o iterable de bloques de `df_dict`."""
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for sheet_name, df in df_dict.items():
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    escritor = None
+    for bloque in _como_bloques(next(iter(df_dict.values()))):
+        tabla = pa.Table.from_pandas(_decimales_a_float(bloque), preserve_index=False)
+        if escritor is None:
+            escritor = pq.ParquetWriter(output, tabla.schema)
+        escritor.write_table(tabla.cast(escritor.schema))
+    if escritor is not None:
+        escritor.close()
     return output.getvalue()
 
+FORMATOS_EXPORTACION = {
+    "Excel": {'escribir': to_excel, 'extension': "xlsx",
+              'mime': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    "CSV": {'escribir': to_csv, 'extension': "csv", 'mime': "text/csv"},
+    "Parquet": {'escribir': to_parquet, 'extension': "parquet", 'mime': "application/octet-stream"},
+}
+
+def clave_exportacion(carga, *filtros):
+    """Identifica una tabla exportable sin recorrerla: la carga de la que sale, las versiones de sus
+    tablas y los filtros aplicados en la página."""
+    return (carga, versiones_de(carga), filtros)
+
+@cacheada('exportacion', ttl=TTL_CARGAS, max_entries=16, show_spinner="Generando archivo…")
+def exportar_tabla(clave, formato, nombre_hoja, _df):
+    """Genera el archivo de `_df`; la caché se indexa por `clave` (ver clave_exportacion), no por el DataFrame.
+
+    Dura lo mismo que las cargas: con las mismas versiones, una carga solo cambia al vencer su TTL.
+    """
+    return FORMATOS_EXPORTACION[formato]['escribir']({nombre_hoja: _df})
+
+def boton_descarga_diferida(etiqueta, nombre_base, generar, version, key):
+    """Ofrece la descarga solo después de que el usuario la pide, generando el archivo en ese momento.
+
+    `generar(formato)` devuelve los bytes del archivo. `version` identifica los datos: si cambia
+    (por ejemplo, al cambiar los filtros), hay que volver a pedir la descarga.
+    """
+    col_formato, col_boton = st.columns([1, 3])
+    formato = col_formato.selectbox("Formato", options=list(FORMATOS_EXPORTACION),
+                                    key=f"{key}_formato", label_visibility="collapsed")
+    pedido = (formato, version)
+    if st.session_state.get(key) == pedido or col_boton.button(f"⚙️ Preparar {etiqueta}", key=f"{key}_preparar"):
+        st.session_state[key] = pedido
+        spec = FORMATOS_EXPORTACION[formato]
+        col_boton.download_button(
+            label=f"📥 Descargar {etiqueta} ({formato})",
+            data=generar(formato),
+            file_name=f"{nombre_base}.{spec['extension']}",
+            mime=spec['mime'],
+            key=f"{key}_descargar"
+        )
+
+# === 📈 Gráficos en caché ===
+# matplotlib se importa solo al dibujar el primer gráfico, y cada imagen se guarda en caché
+# según los datos graficados: un rerun con los mismos datos no vuelve a dibujar nada.
+GRAFICOS_DPI = 100
+
+def _figura_png(dibujar, **kwargs_figura):
+    """Dibuja con `dibujar(fig, ax)` sobre una figura sin pyplot y devuelve los bytes PNG."""
+    from matplotlib.figure import Figure  # import diferido: no pesa en el arranque
+
+    fig = Figure(**kwargs_figura)
+    ax = fig.subplots()
+    dibujar(fig, ax)
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=GRAFICOS_DPI)
+    return buffer.getvalue()
+
+@cacheada('grafico', max_entries=32, show_spinner=False)
+def grafico_deficit(descripciones, deficits):
+    """Barras horizontales del top de repuestos por déficit."""
+    def dibujar(fig, ax):
+        bars = ax.barh(list(descripciones), list(deficits), color='steelblue')
+        ax.set_xlabel('Déficit (unidades)')
+        ax.set_title('Repuestos que requieren reposición urgente')
+        for bar in bars:
+            width = bar.get_width()
+            ax.text(width + 0.1, bar.get_y() + bar.get_height()/2,
+                    f'{int(width)}', va='center', ha='left')
+    return _figura_png(dibujar, figsize=(10, 6), layout="tight")
+
+@cacheada('grafico', max_entries=32, show_spinner=False)
+def grafico_distribucion_costos(costo_tecnico, costo_combustible, costo_repuestos):
+    """Torta con la distribución de costos técnico, combustible y repuestos."""
+    def dibujar(fig, ax):
+        labels = ['Técnico', 'Combustible', 'Repuestos']
+        sizes = [costo_tecnico, costo_combustible, costo_repuestos]
+        colors = ['lightblue', 'lightgreen', 'lightcoral']
+        ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')
+    return _figura_png(dibujar)
+
+# === 🧮 Motor de política de stock ===
+def aplicar_politica_stock(compat_instalada, df_pol):
+    """Asigna a cada par (repuesto, modelo) la banda de política según su número de equipos.
+
+    Equivale a recorrer `compat_instalada` fila por fila y tomar la primera política de
+    `df_pol` (en su orden original) con `equipos_min <= total_equipos` y `equipos_max`
+    nulo o `>= total_equipos`, pero resuelto como un único join por intervalos.
+    """
+    columnas = ['id_repuesto', 'id_modelo', 'stock_minimo', 'total_equipos']
+    if compat_instalada.empty or df_pol.empty:
+        return pd.DataFrame(columns=columnas)
+    
+    compat = compat_instalada[['id_repuesto', 'id_modelo', 'total_equipos']].copy()
+    compat['_fila'] = np.arange(len(compat))
+    pol = df_pol[['id_repuesto', 'equipos_min', 'equipos_max', 'stock_minimo']].copy()
+    pol['_orden'] = np.arange(len(pol))
+    
+    candidatos = compat.merge(pol, on='id_repuesto', how='inner')
+    en_banda = (candidatos['equipos_min'] <= candidatos['total_equipos']) & (
+        candidatos['equipos_max'].isna() | (candidatos['equipos_max'] >= candidatos['total_equipos'])
+    )
+    aplicada = (
+        candidatos[en_banda]
+        .sort_values(['_fila', '_orden'])
+        .drop_duplicates('_fila', keep='first')
+    )
+    return aplicada[columnas].reset_index(drop=True)
+
+# === 🩺 Motor de indicadores de equipos ===
+def _formatear_unicos(serie, formato):
+    """Aplica `formato` una sola vez por valor distinto de `serie` y lo expande a todas las filas."""
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=False)
+    textos = np.array([formato(v) for v in unicos], dtype=object)
+    return pd.Series(textos[codigos], index=serie.index)
+
+def _dias_a_texto(dias):
+    dias = pd.to_numeric(dias, errors='coerce')
+    validos = dias.notna() & (dias > 0)
+    texto = pd.Series("N/A", index=dias.index, dtype=object)
+    texto[validos] = _formatear_unicos(
+        dias[validos], lambda d: f"{int(d):,} días ({d / 365.25:.1f} años)"
+    )
+    return texto
+
+# Prioridades de mayor a menor urgencia; las dos primeras se resaltan en la tabla
+PRIORIDADES = ["⚠️ CRÍTICO", "🔴 ALTA PRIORIDAD", "🟡 Normal", "⚪ Sin datos"]
+PRIORIDADES_URGENTES = PRIORIDADES[:2]
+
+def calcular_indicadores_equipos(df_equipos, hoy):
+    """Calcula MTBF, confiabilidad, próxima falla y prioridad de cada equipo respecto a `hoy`.
+
+    Todas las operaciones son por columnas; los textos se formatean una vez por valor distinto.
+    """
+    df_equipos = df_equipos.copy()
+    hoy = pd.Timestamp(hoy)
+    
+    # Días operativos: hasta hoy si el equipo está activo, si no hasta su último servicio
+    instalacion = pd.to_datetime(df_equipos['fecha_instalacion'])
+    fin = pd.to_datetime(df_equipos['ultimo_servicio']).where(df_equipos['estado'].astype(str) != 'Activo', hoy)
+    df_equipos['dias_operativos'] = (fin - instalacion).dt.days.clip(lower=0)
+    
+    # Calcular MTBF: intervalos entre fallas más el tramo abierto desde la última, por falla
+    df_equipos['fecha_ultima_falla_dt'] = pd.to_datetime(df_equipos['fecha_ultima_falla'])
+    abierto = (fin - df_equipos['fecha_ultima_falla_dt']).dt.days.clip(lower=0).fillna(0)
+    fallas = df_equipos['cantidad_fallas'].astype(float)
+    df_equipos['mtbf_dias'] = ((df_equipos['dias_entre_fallas'] + abierto) / fallas).where(fallas > 0)
+    
+    # Calcular días desde última falla
+    df_equipos['dias_desde_ultima_falla'] = (hoy - df_equipos['fecha_ultima_falla_dt']).dt.days
+    
+    # Calcular confiabilidad a 6 meses (180 días)
+    df_equipos['confiabilidad_6m'] = np.where(
+        pd.notna(df_equipos['mtbf_dias']) & (df_equipos['mtbf_dias'] > 0),
+        np.exp(-180 / df_equipos['mtbf_dias']),
+        np.nan
+    )
+    
+    # Calcular próximas fallas estimadas desde la última falla o, si no hay, desde la instalación
+    mtbf = df_equipos['mtbf_dias'].where(df_equipos['mtbf_dias'] > 0)
+    fecha_base = df_equipos['fecha_ultima_falla_dt'].fillna(pd.to_datetime(df_equipos['fecha_instalacion']))
+    proxima_fecha = fecha_base + pd.to_timedelta(mtbf, unit='D')
+    dias_hasta = (proxima_fecha - hoy).dt.days
+    estimable = proxima_fecha.notna()
+    
+    texto = pd.Series("No estimable", index=df_equipos.index, dtype=object)
+    fecha_str = _formatear_unicos(proxima_fecha[estimable].dt.normalize(), lambda f: f.strftime('%Y-%m-%d'))
+    plazo_str = _formatear_unicos(
+        dias_hasta[estimable].astype('int64'),
+        lambda d: " (¡ya pasó!)" if d < 0 else f" (~{d:,} días)"
+    )
+    texto[estimable] = fecha_str + plazo_str
+    df_equipos['Próxima falla estimada'] = texto
+    df_equipos['Prioridad'] = pd.Categorical(
+        np.select(
+            [estimable & (dias_hasta < 0), estimable & (dias_hasta <= 90), estimable],
+            PRIORIDADES[:3],
+            default=PRIORIDADES[3]
+        ),
+        categories=PRIORIDADES, ordered=True
+    )
+    
+    for col in ['dias_operativos', 'mtbf_dias', 'dias_desde_ultima_falla']:
+        if col in df_equipos.columns:
+            df_equipos[f"{col}_texto"] = _dias_a_texto(df_equipos[col])
+    
+    return df_equipos
+
 # === 📊 Funciones de carga de datos ===
-@st.cache_data(ttl=300)
+@cacheada('carga', ttl=TTL_CARGAS)
 def cargar_datos_maestros():
     """Carga datos maestros para los formularios."""
-    tecnicos = pd.read_sql("SELECT id_tecnico, nombre FROM tecnicos WHERE activo = TRUE", engine)
-    equipos = pd.read_sql("""
-        SELECT e.id_equipo, e.id_cliente, m.nombre_modelo, c.nombre_cliente 
-        FROM equipos_instalados e 
-        JOIN modelos m ON e.id_modelo = m.id_modelo
-        JOIN clientes c ON e.id_cliente = c.id_cliente
-        WHERE e.estado = 'Activo'
-    """, engine)
-    repuestos = pd.read_sql("SELECT id_repuesto, descripcion FROM catalogo_repuestos", engine)
-    contratos = pd.read_sql("SELECT id_contrato, id_cliente FROM contratos WHERE activo = TRUE", engine)
-    
-    return tecnicos, equipos, repuestos, contratos
-
-@st.cache_data(ttl=300)
-def cargar_analisis_stock():
-    """Carga análisis de stock actual vs requerido."""
-    df_rep = pd.read_sql("SELECT * FROM catalogo_repuestos", engine)
-    df_inv = pd.read_sql("SELECT * FROM inventario_logistico", engine)
-    df_pol = pd.read_sql("SELECT * FROM politica_stock_repuestos", engine)
-    df_eq = pd.read_sql("SELECT * FROM equipos_instalados", engine)
-    df_compat = pd.read_sql("SELECT * FROM compatibilidad", engine)
-    df_mod = pd.read_sql("SELECT * FROM modelos", engine)
+    maestros = leer_en_paralelo('cargar_datos_maestros', {
+        'tecnicos': "SELECT id_tecnico, nombre FROM tecnicos WHERE activo = TRUE",
+        'equipos': """
+            SELECT e.id_equipo, e.id_cliente, m.nombre_modelo, c.nombre_cliente 
+            FROM equipos_instalados e 
+            JOIN modelos m ON e.id_modelo = m.id_modelo
+            JOIN clientes c ON e.id_cliente = c.id_cliente
+            WHERE e.estado = 'Activo'
+        """,
+        'repuestos': "SELECT id_repuesto, descripcion FROM catalogo_repuestos",
+        'contratos': "SELECT id_contrato, id_cliente FROM contratos WHERE activo = TRUE",
+    })
+    tecnicos, equipos = maestros['tecnicos'], maestros['equipos']
+    repuestos, contratos = maestros['repuestos'], maestros['contratos']
+    indices = construir_indices_maestros(tecnicos, equipos, repuestos, contratos)
+    return tecnicos, equipos, repuestos, contratos, indices
+
+def construir_indices_maestros(tecnicos, equipos, repuestos, contratos):
+    """Índices precalculados para que los selectbox no filtren los DataFrames en cada opción."""
+    etiquetas_equipos = (
+        equipos['id_equipo'].astype(str) + " - " + equipos['nombre_modelo'].astype(str)
+        + " (" + equipos['nombre_cliente'].astype(str) + ")"
+    )
+    return {
+        'tecnicos': dict(zip(tecnicos['id_tecnico'], tecnicos['nombre'])),
+        'equipos': dict(zip(equipos['id_equipo'], etiquetas_equipos)),
+        'cliente_por_equipo': dict(zip(equipos['id_equipo'], equipos['id_cliente'])),
+        'repuestos': dict(zip(repuestos['id_repuesto'], repuestos['descripcion'])),
+        'contratos_por_cliente': contratos.groupby('id_cliente')['id_contrato'].agg(list).to_dict(),
+    }
+
+# === 🔎 Índice de búsqueda para los selectores de equipos y repuestos ===
+BUSQUEDA_LIMITE = 50
+
+def _normalizar(textos):
+    """Pasa a minúsculas y quita tildes a una serie de textos."""
+    return (
+        textos.astype(str).str.lower()
+        .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    )
+
+def construir_indice_busqueda(ids, textos):
+    """Construye un índice invertido token -> filas, con vocabulario ordenado para buscar por prefijo."""
+    normalizados = _normalizar(pd.Series(list(textos)))
+    tokens = normalizados.str.findall(r"\w+").explode().dropna()
+    pares = pd.DataFrame({'token': tokens.values, 'fila': tokens.index.values}).drop_duplicates()
+    pares = pares.sort_values(['token', 'fila'])
+    vocabulario, inicios = np.unique(pares['token'].values, return_index=True)
+    filas = pares['fila'].values.astype(np.int64)
+    return {
+        'ids': np.asarray(list(ids)),
+        # Texto normalizado con espacio inicial, para verificar prefijos " termino" sobre pocas filas
+        'textos': (" " + normalizados.str.replace(r"\W+", " ", regex=True)).values,
+        'vocabulario': vocabulario.tolist(),
+        # Filas de cada token, contiguas y en orden: las del token i van de inicios[i] a inicios[i + 1]
+        'inicios': np.append(inicios, len(filas)),
+        'filas': filas,
+    }
+
+def buscar_en_indice(indice, consulta, limite=BUSQUEDA_LIMITE):
+    """Devuelve hasta `limite` ids cuyas palabras empiezan por todos los términos de `consulta`."""
+    consulta = unicodedata.normalize('NFKD', (consulta or "").lower()).encode('ascii', 'ignore').decode('ascii')
+    terminos = set(re.findall(r"\w+", consulta))
+    if not terminos:
+        return indice['ids'][:limite].tolist()
+    
+    vocabulario, inicios = indice['vocabulario'], indice['inicios']
+    rangos = {}
+    for termino in terminos:
+        ini = bisect_left(vocabulario, termino)
+        fin = bisect_left(vocabulario, termino + "\uffff")
+        if ini == fin:
+            return []
+        rangos[termino] = (ini, fin)
+    
+    # Se parte del término con menos coincidencias y el resto se verifica por bloques
+    # sobre esas filas, deteniéndose en cuanto hay `limite` resultados
+    por_tamano = sorted(terminos, key=lambda t: inicios[rangos[t][1]] - inicios[rangos[t][0]])
+    ini, fin = rangos[por_tamano[0]]
+    candidatas = indice['filas'][inicios[ini]:inicios[fin]]
+    if fin - ini > 1:
+        candidatas = np.unique(candidatas)
+    resultado = []
+    for desde in range(0, len(candidatas), 1024):
+        filas = candidatas[desde:desde + 1024]
+        for termino in por_tamano[1:]:
+            textos = pd.Series(indice['textos'][filas])
+            filas = filas[textos.str.contains(" " + termino, regex=False).values]
+        resultado.extend(filas[:limite - len(resultado)])
+        if len(resultado) >= limite:
+            break
+    return indice['ids'][resultado].tolist()
+
+@cacheada('carga', st.cache_resource, ttl=TTL_CARGAS)
+def cargar_indices_busqueda():
+    """Índices de búsqueda de equipos y repuestos, compartidos entre sesiones."""
+    _, equipos, repuestos, _, _ = cargar_datos_maestros()
+    return construir_indices_busqueda(equipos, repuestos)
+
+def construir_indices_busqueda(equipos, repuestos):
+    """Índices de búsqueda de equipos (id, modelo y cliente) y de repuestos (id y descripción)."""
+    return {
+        'equipos': construir_indice_busqueda(
+            equipos['id_equipo'],
+            equipos['id_equipo'].astype(str) + " " + equipos['nombre_modelo'].astype(str)
+            + " " + equipos['nombre_cliente'].astype(str)
+        ),
+        'repuestos': construir_indice_busqueda(
+            repuestos['id_repuesto'],
+            repuestos['id_repuesto'].astype(str) + " " + repuestos['descripcion'].astype(str)
+        ),
+    }
+
+def selector_con_busqueda(etiqueta, indice, format_func, key):
+    """Campo de búsqueda más selectbox que solo recibe las mejores coincidencias del índice."""
+    consulta = st.text_input(f"Buscar {etiqueta.lower()}", key=f"{key}_busqueda",
+                             placeholder="Escribe ID o palabras clave")
+    opciones = buscar_en_indice(indice, consulta)
+    if not opciones:
+        st.warning(f"No hay coincidencias para '{consulta}'")
+        return None
+    return st.selectbox(etiqueta, options=opciones, format_func=format_func, key=key)
+
+def _analisis_stock_pandas():
+    """Calcula el análisis de stock en pandas a partir de las tablas completas."""
+    tablas = leer_en_paralelo('cargar_analisis_stock', {
+        'rep': "SELECT * FROM catalogo_repuestos",
+        'inv': "SELECT * FROM inventario_logistico",
+        'pol': "SELECT * FROM politica_stock_repuestos ORDER BY id_politica",
+        'eq': "SELECT * FROM equipos_instalados",
+        'compat': "SELECT * FROM compatibilidad",
+        'mod': "SELECT * FROM modelos",
+    })
+    df_rep, df_inv, df_pol = tablas['rep'], tablas['inv'], tablas['pol']
+    df_eq, df_compat, df_mod = tablas['eq'], tablas['compat'], tablas['mod']
     
     equipos_por_modelo = df_eq.groupby('id_modelo').size().reset_index(name='total_equipos')
     compat_instalada = df_compat.merge(equipos_por_modelo, on='id_modelo', how='inner')
     
-    politica_aplicada = []
-    for _, row in compat_instalada.iterrows():
-        repuesto_id = row['id_repuesto']
-        modelo_id = row['id_modelo']
-        total_equipos = row['total_equipos']
-        
-        pol_filtro = df_pol[df_pol['id_repuesto'] == repuesto_id].copy()
-        pol_aplicable = pol_filtro[
-            (pol_filtro['equipos_min'] <= total_equipos) & 
-            (pol_filtro['equipos_max'].isna() | (pol_filtro['equipos_max'] >= total_equipos))
-        ]
-        if not pol_aplicable.empty:
-            stock_req = pol_aplicable.iloc[0]['stock_minimo']
-            politica_aplicada.append({
-                'id_repuesto': repuesto_id,
-                'id_modelo': modelo_id,
-                'stock_minimo': stock_req,
-                'total_equipos': total_equipos
-            })
-    
-    if not politica_aplicada:
+    df_pol_aplicada = aplicar_politica_stock(compat_instalada, df_pol)
+    if df_pol_aplicada.empty:
         return pd.DataFrame()
     
-    df_pol_aplicada = pd.DataFrame(politica_aplicada)
     stock_min_total = df_pol_aplicada.groupby('id_repuesto')['stock_minimo'].sum().reset_index()
     stock_min_total.columns = ['id_repuesto', 'stock_minimo_total']
     
     if df_inv.empty:
         df_inv_for_merge = pd.DataFrame(columns=['id_repuesto', 'stock_actual'])
     else:
-        df_inv_for_merge = df_inv[['id_repuesto', 'stock_actual']]
+        # Un repuesto puede tener varias filas de inventario: se suman, como en SQL_ANALISIS_STOCK
+        df_inv_for_merge = (
+            df_inv.assign(stock_actual=pd.to_numeric(df_inv['stock_actual'], errors='coerce'))
+            .groupby('id_repuesto', as_index=False)['stock_actual'].sum()
+        )
     
     df_stock = stock_min_total.merge(df_inv_for_merge, on='id_repuesto', how='left')
     df_stock['stock_actual'] = pd.to_numeric(df_stock['stock_actual'], errors='coerce').fillna(0)
@@ -134,171 +1194,1106 @@ def cargar_analisis_stock():
     
     return df_stock.sort_values('deficit', ascending=False)
 
-@st.cache_data(ttl=300)
-def cargar_costos_operativos():
-    """Carga análisis de costos operativos por técnico y contrato."""
-    df_costos = pd.read_sql("""
-        SELECT 
-            s.id_servicio,
-            s.fecha,
-            t.nombre AS tecnico,
-            e.id_equipo,
-            cli.nombre_cliente,
-            s.duracion_horas,
-            s.km_recorridos,
-            COALESCE(SUM(cr.cantidad * cat.precio_unitario), 0) AS costo_repuestos,
-            (s.duracion_horas * ((tec.salario_bruto * 1.35) / 160)) AS costo_tecnico,
-            (s.km_recorridos * (750.00 / tec.vehiculo_km_l)) AS costo_combustible
-        FROM servicios_tecnicos s
+# Déficit de stock calculado por completo en el servidor: conteo de equipos por modelo,
+# banda de política aplicable, stock sumado y modelos asociados, una fila por repuesto.
+# Si varias bandas aplican gana la de menor id_politica, la misma que toma aplicar_politica_stock
+# en el cálculo en pandas (que lee las políticas ordenadas por id_politica).
+SQL_ANALISIS_STOCK = """
+    WITH equipos_por_modelo AS (
+        SELECT id_modelo, COUNT(*) AS total_equipos
+        FROM equipos_instalados
+        GROUP BY id_modelo
+    ),
+    politica_aplicada AS (
+        SELECT
+            c.id_repuesto,
+            c.id_modelo,
+            p.stock_minimo,
+            ROW_NUMBER() OVER (
+                PARTITION BY c.id_repuesto, c.id_modelo ORDER BY p.id_politica
+            ) AS orden
+        FROM compatibilidad c
+        JOIN equipos_por_modelo epm ON c.id_modelo = epm.id_modelo
+        JOIN politica_stock_repuestos p ON p.id_repuesto = c.id_repuesto
+            AND p.equipos_min <= epm.total_equipos
+            AND (p.equipos_max IS NULL OR p.equipos_max >= epm.total_equipos)
+    ),
+    stock_minimo AS (
+        SELECT
+            pa.id_repuesto,
+            SUM(pa.stock_minimo) AS stock_minimo_total,
+            STRING_AGG(DISTINCT m.nombre_modelo, ', ' ORDER BY m.nombre_modelo) AS modelos_asociados
+        FROM politica_aplicada pa
+        LEFT JOIN modelos m ON pa.id_modelo = m.id_modelo
+        WHERE pa.orden = 1
+        GROUP BY pa.id_repuesto
+    ),
+    inventario AS (
+        SELECT id_repuesto, SUM(stock_actual) AS stock_actual
+        FROM inventario_logistico
+        GROUP BY id_repuesto
+    )
+    SELECT
+        sm.id_repuesto,
+        sm.stock_minimo_total,
+        CAST(COALESCE(inv.stock_actual, 0) AS DOUBLE PRECISION) AS stock_actual,
+        r.descripcion,
+        r.tipo_repuesto,
+        r.criticidad,
+        sm.modelos_asociados,
+        CAST(GREATEST(sm.stock_minimo_total - COALESCE(inv.stock_actual, 0), 0) AS DOUBLE PRECISION) AS deficit
+    FROM stock_minimo sm
+    LEFT JOIN inventario inv ON sm.id_repuesto = inv.id_repuesto
+    LEFT JOIN catalogo_repuestos r ON sm.id_repuesto = r.id_repuesto
+    ORDER BY deficit DESC
+"""
+
+@cacheada('carga', ttl=TTL_CARGAS)
+@instantanea_disco('analisis_stock', version=4)
+def cargar_analisis_stock():
+    """Carga análisis de stock actual vs requerido."""
+    try:
+        with conexion_lectura('cargar_analisis_stock') as conn:
+            df_stock = pd.read_sql(SQL_ANALISIS_STOCK, conn)
+    except SQLAlchemyError:
+        # Si la consulta en servidor falla, se recurre al cálculo en pandas
+        df_stock = _analisis_stock_pandas()
+    return compactar_tipos(df_stock, 'cargar_analisis_stock')
+
+SQL_COSTOS_OPERATIVOS = """
+    SELECT 
+        s.id_servicio,
+        s.fecha,
+        tec.nombre AS tecnico,
+        e.id_equipo,
+        cli.nombre_cliente,
+        s.duracion_horas,
+        s.km_recorridos,
+        COALESCE(SUM(cr.cantidad * cat.precio_unitario), 0) AS costo_repuestos,
+        (s.duracion_horas * ((tec.salario_bruto * 1.35) / 160)) AS costo_tecnico,
+        (s.km_recorridos * (750.00 / tec.vehiculo_km_l)) AS costo_combustible
+    FROM {servicios} s
+    LEFT JOIN tecnicos tec ON s.id_tecnico = tec.id_tecnico
+    LEFT JOIN consumo_repuestos cr ON s.id_servicio = cr.id_servicio
+    LEFT JOIN catalogo_repuestos cat ON cr.id_repuesto = cat.id_repuesto
+    LEFT JOIN equipos_instalados e ON s.id_equipo = e.id_equipo
+    LEFT JOIN clientes cli ON e.id_cliente = cli.id_cliente
+    {filtro}
+    GROUP BY s.id_servicio, s.fecha, tec.nombre, e.id_equipo, cli.nombre_cliente, 
+             s.duracion_horas, s.km_recorridos, tec.salario_bruto, tec.vehiculo_km_l
+    {orden}
+"""
+
+COSTOS_FILAS_POR_PAGINA = 100
+
+def _filtro_costos(tecnicos, fecha_inicio, fecha_fin):
+    """Arma la cláusula WHERE y los parámetros de los filtros de la pestaña de costos."""
+    condiciones = ["s.fecha BETWEEN :fecha_inicio AND :fecha_fin"]
+    params = {'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin}
+    if tecnicos:
+        condiciones.append("tec.nombre IN :tecnicos")
+        params['tecnicos'] = list(tecnicos)
+    return condiciones, params
+
+def _sentencia_costos(sql, params):
+    consulta = text(sql)
+    if 'tecnicos' in params:
+        consulta = consulta.bindparams(bindparam('tecnicos', expanding=True))
+    return consulta
+
+def _consulta_costos(sql, params):
+    with conexion_lectura('consultar_costos') as conn:
+        return pd.read_sql(_sentencia_costos(sql, params), conn, params=params)
+
+@cacheada('carga', ttl=TTL_CARGAS)
+def cargar_opciones_costos():
+    """Carga los técnicos y el rango de fechas disponibles para los filtros de costos."""
+    opciones = leer_en_paralelo('cargar_opciones_costos', {
+        'tecnicos': "SELECT nombre FROM tecnicos ORDER BY nombre",
+        'rango': "SELECT MIN(fecha) AS fecha_min, MAX(fecha) AS fecha_max FROM servicios_tecnicos",
+    })
+    tecnicos, rango = opciones['tecnicos'], opciones['rango']
+    return tecnicos['nombre'].tolist(), rango['fecha_min'].iloc[0], rango['fecha_max'].iloc[0]
+
+@cacheada('carga', ttl=TTL_CARGAS)
+def cargar_resumen_costos(tecnicos, fecha_inicio, fecha_fin):
+    """Totales de servicios y costos para los filtros dados.
+
+    Los meses enteros del rango salen de los resúmenes mensuales; solo los días sueltos de los
+    extremos se calculan desde los servicios.
+    """
+    condiciones, params = _filtro_costos(tecnicos, fecha_inicio, fecha_fin)
+    params['mes_desde'], params['mes_hasta'] = _meses_completos(fecha_inicio, fecha_fin)
+    filtro_meses = "WHERE r.mes >= :mes_desde AND r.mes < :mes_hasta"
+    if tecnicos:
+        filtro_meses += " AND tec.nombre IN :tecnicos"
+    condiciones.append("(s.fecha < :mes_desde OR s.fecha >= :mes_hasta)")
+    sql = f"""
+        WITH meses AS (
+            SELECT
+                COALESCE(SUM(r.servicios), 0) AS total_servicios,
+                COALESCE(SUM(r.horas * ((tec.salario_bruto * 1.35) / 160)), 0) AS costo_tecnico,
+                COALESCE(SUM(r.km * (750.00 / tec.vehiculo_km_l)), 0) AS costo_combustible
+            FROM costos_mensuales r
+            LEFT JOIN tecnicos tec ON r.id_tecnico = tec.id_tecnico
+            {filtro_meses}
+        ), repuestos_meses AS (
+            SELECT COALESCE(SUM(r.cantidad * cat.precio_unitario), 0) AS costo_repuestos
+            FROM consumo_mensual r
+            LEFT JOIN catalogo_repuestos cat ON r.id_repuesto = cat.id_repuesto
+            LEFT JOIN tecnicos tec ON r.id_tecnico = tec.id_tecnico
+            {filtro_meses}
+        ), extremos AS (
+            SELECT
+                COUNT(*) AS total_servicios,
+                COALESCE(SUM(costo_tecnico), 0) AS costo_tecnico,
+                COALESCE(SUM(costo_combustible), 0) AS costo_combustible,
+                COALESCE(SUM(costo_repuestos), 0) AS costo_repuestos
+            FROM ({SQL_COSTOS_OPERATIVOS.format(
+                servicios="servicios_tecnicos", filtro="WHERE " + " AND ".join(condiciones), orden=""
+            )}) costos
+        )
+        SELECT
+            meses.total_servicios + extremos.total_servicios AS total_servicios,
+            CAST(meses.costo_tecnico + extremos.costo_tecnico AS DOUBLE PRECISION) AS costo_tecnico,
+            CAST(meses.costo_combustible + extremos.costo_combustible AS DOUBLE PRECISION) AS costo_combustible,
+            CAST(repuestos_meses.costo_repuestos + extremos.costo_repuestos AS DOUBLE PRECISION) AS costo_repuestos
+        FROM meses, repuestos_meses, extremos
+    """
+    return _consulta_costos(sql, params).iloc[0]
+
+@cacheada('carga', ttl=TTL_CARGAS)
+def cargar_pagina_costos(tecnicos, fecha_inicio, fecha_fin, cursor=None, limite=COSTOS_FILAS_POR_PAGINA):
+    """Carga una página del detalle de costos, paginada por (fecha, id_servicio) descendente.
+
+    `cursor` es el par (fecha, id_servicio) de la última fila de la página anterior.
+    Se pide una fila extra para saber si existe una página siguiente. Los servicios de la página se
+    eligen primero, por el índice de fecha; los repuestos y costos se calculan solo para ellos.
+    """
+    condiciones, params = _filtro_costos(tecnicos, fecha_inicio, fecha_fin)
+    if cursor is not None:
+        condiciones.append("(s.fecha, s.id_servicio) < (:cursor_fecha, :cursor_id)")
+        params['cursor_fecha'], params['cursor_id'] = cursor
+    params['limite'] = limite + 1
+    pagina = f"""(
+        SELECT s.* FROM servicios_tecnicos s
         LEFT JOIN tecnicos tec ON s.id_tecnico = tec.id_tecnico
-        LEFT JOIN consumo_repuestos cr ON s.id_servicio = cr.id_servicio
-        LEFT JOIN catalogo_repuestos cat ON cr.id_repuesto = cat.id_repuesto
-        LEFT JOIN equipos_instalados e ON s.id_equipo = e.id_equipo
-        LEFT JOIN clientes cli ON e.id_cliente = cli.id_cliente
-        LEFT JOIN tecnicos t ON s.id_tecnico = t.id_tecnico
-        GROUP BY s.id_servicio, s.fecha, t.nombre, e.id_equipo, cli.nombre_cliente, 
-                 s.duracion_horas, s.km_recorridos, tec.salario_bruto, tec.vehiculo_km_l
-        ORDER BY s.fecha DESC
-    """, engine)
-    
-    return df_costos
-
-@st.cache_data(ttl=300)
+        WHERE {" AND ".join(condiciones)}
+        ORDER BY s.fecha DESC, s.id_servicio DESC
+        LIMIT :limite
+    )"""
+    sql = SQL_COSTOS_OPERATIVOS.format(servicios=pagina, filtro="", orden="ORDER BY s.fecha DESC, s.id_servicio DESC")
+    return _consulta_costos(sql, params)
+
+def bloques_costos(tecnicos, fecha_inicio, fecha_fin, tamano=EXPORTACION_FILAS_POR_BLOQUE):
+    """Recorre el historial de costos filtrado en bloques, con un cursor del lado del servidor."""
+    condiciones, params = _filtro_costos(tecnicos, fecha_inicio, fecha_fin)
+    sql = SQL_COSTOS_OPERATIVOS.format(
+        servicios="servicios_tecnicos",
+        filtro="WHERE " + " AND ".join(condiciones),
+        orden="ORDER BY s.fecha DESC, s.id_servicio DESC"
+    )
+    with conexion_lectura('consultar_costos') as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=tamano)
+        yield from pd.read_sql(_sentencia_costos(sql, params), conn, params=params, chunksize=tamano)
+
+@cacheada('exportacion', ttl=TTL_CARGAS, max_entries=8, show_spinner="Generando archivo…")
+def exportar_costos(tecnicos, fecha_inicio, fecha_fin, formato):
+    """Genera el archivo del historial de costos filtrado sin cargarlo completo en un DataFrame."""
+    return FORMATOS_EXPORTACION[formato]['escribir']({
+        "Costos_Operativos": bloques_costos(tecnicos, fecha_inicio, fecha_fin)
+    })
+
+@cacheada('carga', ttl=TTL_CARGAS)
+@instantanea_disco('indicadores_equipos', version=4)
 def cargar_indicadores_equipos():
-    """Carga los indicadores de equipos como en el script original."""
+    """Carga los indicadores de equipos, con las fallas contadas en el historial de servicios."""
     # Obtener datos básicos de equipos
-    df_equipos = pd.read_sql("""
-        SELECT 
-            e.id_equipo,
-            e.id_cliente,
-            e.id_modelo,
-            e.ano_fabricacion,
-            e.fecha_instalacion,
-            e.zona,
-            e.tiempo_viaje,
-            e.estado,
-            e.tipo_contrato,
-            e.tipo_cliente,
-            e.observaciones,
-            e.fecha_ultima_falla,
-            e.cantidad_fallas,
-            e.dias_operativos,
-            m.nombre_modelo,
-            m.marca,
-            c.nombre_cliente,
-            c.codigo_referencia
-        FROM equipos_instalados e
-        JOIN modelos m ON e.id_modelo = m.id_modelo
-        JOIN clientes c ON e.id_cliente = c.id_cliente
-    """, engine)
-    
-    # Calcular MTBF y confiabilidad
-    df_equipos['mtbf_dias'] = np.where(
-        df_equipos['cantidad_fallas'] > 0,
-        df_equipos['dias_operativos'] / df_equipos['cantidad_fallas'],
-        np.nan
+    with conexion_lectura('cargar_indicadores_equipos') as conn:
+        df_equipos = pd.read_sql("""
+            SELECT 
+                e.id_equipo,
+                e.id_cliente,
+                e.id_modelo,
+                e.ano_fabricacion,
+                e.fecha_instalacion,
+                e.zona,
+                e.tiempo_viaje,
+                e.estado,
+                e.tipo_contrato,
+                e.tipo_cliente,
+                e.observaciones,
+                f.ultima_falla AS fecha_ultima_falla,
+                COALESCE(f.fallas, 0) AS cantidad_fallas,
+                f.dias_entre_fallas,
+                f.ultimo_servicio,
+                m.nombre_modelo,
+                m.marca,
+                c.nombre_cliente,
+                c.codigo_referencia
+            FROM equipos_instalados e
+            JOIN modelos m ON e.id_modelo = m.id_modelo
+            JOIN clientes c ON e.id_cliente = c.id_cliente
+            LEFT JOIN confiabilidad_equipos f ON e.id_equipo = f.id_equipo
+        """, conn)
+    
+    # Los equipos más urgentes primero, y dentro de cada prioridad los menos confiables
+    df_equipos = calcular_indicadores_equipos(df_equipos, pd.Timestamp.today()).sort_values(
+        ['Prioridad', 'confiabilidad_6m'], na_position='last', kind='stable', ignore_index=True
     )
+    return compactar_tipos(df_equipos, 'cargar_indicadores_equipos')
+
+# === 🎲 Simulación de reposición ===
+# Simula la demanda de todos los repuestos a la vez, escenario por escenario, con arreglos de NumPy:
+# 1. Las fallas de cada modelo en el horizonte son Poisson con tasa Σ 1/MTBF de sus equipos activos.
+# 2. Cada falla de un modelo genera consumos de cada repuesto con la tasa por falla observada en el
+#    historial (consumos del par repuesto-modelo ÷ fallas esperadas del parque de entonces).
+# 3. Cada consumo lleva la cantidad media histórica del par (1 + Poisson del excedente).
+# Así la demanda sigue al historial, crece o cae con el parque instalado y los repuestos de un
+# mismo modelo se correlacionan porque comparten sus fallas.
+SIMULACION_DIAS_HISTORIAL = 365
+SIMULACION_ESCENARIOS = 2_000
+# Tiempo máximo por proceso; si se agota, se usan los escenarios simulados hasta ese momento
+SIMULACION_PRESUPUESTO_S = 3.0
+# Tamaño de cada lote (escenarios × pares repuesto-modelo): acota la memoria de cada arreglo
+SIMULACION_CELDAS_POR_LOTE = 2_000_000
+# A partir de cuántas celdas por proceso conviene repartir los escenarios en varios procesos
+SIMULACION_CELDAS_POR_PROCESO = 20_000_000
+
+SQL_CONSUMO_HISTORICO = """
+    WITH fin AS (SELECT MAX(fecha) AS fin FROM servicios_tecnicos)
+    SELECT cr.id_repuesto, e.id_modelo, COUNT(*) AS eventos, SUM(cr.cantidad) AS cantidad
+    FROM consumo_repuestos cr
+    JOIN servicios_tecnicos s ON cr.id_servicio = s.id_servicio
+    JOIN equipos_instalados e ON s.id_equipo = e.id_equipo
+    CROSS JOIN fin
+    WHERE s.fecha > fin.fin - CAST(:dias AS INTEGER) AND cr.cantidad > 0
+    GROUP BY cr.id_repuesto, e.id_modelo
+    ORDER BY cr.id_repuesto, e.id_modelo
+"""
+
+@cacheada('carga', ttl=TTL_CARGAS)
+def cargar_historial_consumo(dias):
+    """Consumo de los últimos `dias` días con datos por par (repuesto, modelo), stock por repuesto
+    y fecha final del historial."""
+    with conexion_lectura('cargar_historial_consumo') as conn:
+        consumo = pd.read_sql(text(SQL_CONSUMO_HISTORICO), conn, params={'dias': dias})
+        stock = pd.read_sql("""
+            SELECT r.id_repuesto, r.descripcion, r.criticidad,
+                   CAST(COALESCE(SUM(i.stock_actual), 0) AS INTEGER) AS stock_actual
+            FROM catalogo_repuestos r
+            LEFT JOIN inventario_logistico i ON r.id_repuesto = i.id_repuesto
+            GROUP BY r.id_repuesto, r.descripcion, r.criticidad
+        """, conn)
+        fin = conn.execute(text("SELECT MAX(fecha) FROM servicios_tecnicos")).scalar()
+    return compactar_tipos(consumo), compactar_tipos(stock), fin
+
+def modelo_de_demanda(consumo, equipos, fin, dias):
+    """Arreglos que usa simular_demanda, a partir del consumo por par y del MTBF de cada equipo."""
+    # Tasa de fallas por día de cada equipo; sin historial de fallas se usa la mediana del parque
+    tasa = 1 / pd.to_numeric(equipos['mtbf_dias'], errors='coerce').where(lambda m: m > 0)
+    tasa = tasa.fillna(tasa.median() if tasa.notna().any() else 1.0)
+    # Fracción de la ventana del historial en que cada equipo ya estaba instalado
+    instalacion = pd.to_datetime(equipos['fecha_instalacion'])
+    inicio_ventana = pd.Timestamp(fin) - pd.Timedelta(days=dias)
+    expuesto = ((pd.Timestamp(fin) - instalacion.clip(lower=inicio_ventana)).dt.days / dias).clip(0, 1).fillna(1)
+    parque = pd.DataFrame({
+        'id_modelo': equipos['id_modelo'].to_numpy(),
+        'tasa_actual': np.where(equipos['estado'].astype(str) == 'Activo', tasa, 0.0),
+        'tasa_historial': tasa * expuesto,
+    }).groupby('id_modelo').sum()
     
-    # Calcular días desde última falla
-    hoy = pd.Timestamp.today()
-    df_equipos['fecha_ultima_falla_dt'] = pd.to_datetime(df_equipos['fecha_ultima_falla'])
-    df_equipos['dias_desde_ultima_falla'] = np.where(
-        pd.notna(df_equipos['fecha_ultima_falla_dt']),
-        (hoy - df_equipos['fecha_ultima_falla_dt']).dt.days,
-        np.nan
+    pares = consumo.merge(parque, left_on='id_modelo', right_index=True, how='left').fillna(
+        {'tasa_actual': 0.0, 'tasa_historial': 0.0}
     )
+    pares = pares[pares['tasa_actual'] > 0].sort_values(['id_repuesto', 'id_modelo'], ignore_index=True)
+    base = pares['tasa_historial'].where(pares['tasa_historial'] > 0, pares['tasa_actual'])
+    modelos, modelo_del_par = np.unique(pares['id_modelo'].to_numpy(), return_inverse=True)
+    repuestos, inicio_repuesto = np.unique(pares['id_repuesto'].to_numpy(), return_index=True)
+    return {
+        'repuestos': repuestos,
+        'inicio_repuesto': inicio_repuesto,
+        'tasa_fallas': parque['tasa_actual'].reindex(modelos).to_numpy(),
+        'modelo_del_par': modelo_del_par,
+        'consumo_por_falla': (pares['eventos'] / (dias * base)).to_numpy(),
+        'extra_por_consumo': (pares['cantidad'] / pares['eventos'] - 1).to_numpy(),
+    }
+
+def simular_demanda(modelo, horizonte, escenarios, semilla=None, presupuesto_s=None):
+    """Matriz (escenarios × repuestos) con la demanda simulada de cada repuesto en `horizonte` días.
+
+    Simula por lotes y se detiene antes si se agota `presupuesto_s`; siempre completa al menos un lote.
+    """
+    rng = np.random.default_rng(semilla)
+    pares = len(modelo['modelo_del_par'])
+    if pares == 0:
+        return np.zeros((escenarios, 0), dtype=np.int32)
+    lote = max(1, SIMULACION_CELDAS_POR_LOTE // pares)
+    inicio = time.perf_counter()
+    lotes, hechos = [], 0
+    while hechos < escenarios:
+        n = min(lote, escenarios - hechos)
+        fallas = rng.poisson(horizonte * modelo['tasa_fallas'], size=(n, len(modelo['tasa_fallas'])))
+        consumos = rng.poisson(modelo['consumo_por_falla'] * fallas[:, modelo['modelo_del_par']])
+        cantidades = consumos + rng.poisson(consumos * modelo['extra_por_consumo'])
+        lotes.append(np.add.reduceat(cantidades, modelo['inicio_repuesto'], axis=1).astype(np.int32))
+        hechos += n
+        if presupuesto_s is not None and time.perf_counter() - inicio > presupuesto_s:
+            break
+    return np.concatenate(lotes)
+
+@st.cache_resource
+def _procesos_simulacion():
+    """Procesos para simulaciones grandes. Arrancan con spawn: importan este módulo sin interfaz."""
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+
+def simular_en_paralelo(modelo, horizonte, escenarios, semilla=0, presupuesto_s=SIMULACION_PRESUPUESTO_S):
+    """Como simular_demanda, pero reparte los escenarios entre procesos cuando el catálogo es grande."""
+    celdas = escenarios * len(modelo['modelo_del_par'])
+    procesos = int(min(os.cpu_count() or 1, escenarios, max(1, -(-celdas // SIMULACION_CELDAS_POR_PROCESO))))
+    semillas = np.random.SeedSequence(semilla).spawn(procesos)
+    if procesos == 1:
+        return simular_demanda(modelo, horizonte, escenarios, semillas[0], presupuesto_s)
+    ejecutor = _procesos_simulacion()
+    futuros = [
+        ejecutor.submit(simular_demanda, modelo, horizonte, len(parte), semilla_proceso, presupuesto_s)
+        for parte, semilla_proceso in zip(np.array_split(np.arange(escenarios), procesos), semillas)
+    ]
+    return np.concatenate([futuro.result() for futuro in futuros])
+
+@cacheada('simulacion', ttl=TTL_CARGAS, show_spinner="Simulando demanda…")
+def planificar_reposicion(horizonte, nivel_servicio, escenarios=SIMULACION_ESCENARIOS, semilla=0):
+    """Probabilidad de quiebre en `horizonte` días y cantidad a pedir de cada repuesto.
+
+    La cantidad sugerida lleva el stock hasta el percentil `nivel_servicio` de la demanda simulada,
+    sin bajar del mínimo de la política. Devuelve (plan, datos de la corrida).
+    """
+    consumo, stock, fin = cargar_historial_consumo(SIMULACION_DIAS_HISTORIAL)
+    equipos = cargar_indicadores_equipos()
+    politica = cargar_analisis_stock()
+    inicio = time.perf_counter()
+    modelo = modelo_de_demanda(consumo, equipos, fin, SIMULACION_DIAS_HISTORIAL)
+    demanda = simular_en_paralelo(modelo, horizonte, escenarios, semilla)
     
-    # Calcular confiabilidad a 6 meses (180 días)
-    df_equipos['confiabilidad_6m'] = np.where(
-        pd.notna(df_equipos['mtbf_dias']) & (df_equipos['mtbf_dias'] > 0),
-        np.exp(-180 / df_equipos['mtbf_dias']),
-        np.nan
+    # Repuestos sin consumo en el historial: demanda cero en todos los escenarios
+    columna = pd.Series(np.arange(len(modelo['repuestos'])), index=modelo['repuestos'])
+    posicion = columna.reindex(stock['id_repuesto'].to_numpy())
+    con_demanda = posicion.notna().to_numpy()
+    demanda_stock = np.zeros((len(demanda), len(stock)), dtype=np.int32)
+    demanda_stock[:, con_demanda] = demanda[:, posicion[con_demanda].astype(int).to_numpy()]
+    
+    minimo = stock['id_repuesto'].map(
+        politica.set_index('id_repuesto')['stock_minimo_total'] if not politica.empty else {}
+    ).fillna(0).to_numpy()
+    stock_actual = stock['stock_actual'].to_numpy()
+    percentil = np.quantile(demanda_stock, nivel_servicio, axis=0, method='higher')
+    objetivo = np.maximum(percentil, minimo)
+    plan = stock.assign(
+        demanda_media=demanda_stock.mean(axis=0),
+        demanda_percentil=percentil,
+        prob_quiebre=(demanda_stock > stock_actual).mean(axis=0),
+        stock_minimo_total=minimo,
+        cantidad_sugerida=np.ceil(np.maximum(objetivo - stock_actual, 0)).astype(int),
+    )
+    plan = plan[(plan['demanda_media'] > 0) | (plan['cantidad_sugerida'] > 0)].sort_values(
+        ['prob_quiebre', 'cantidad_sugerida'], ascending=False, ignore_index=True
     )
+    datos = {'escenarios': len(demanda), 'segundos': time.perf_counter() - inicio,
+             'pares': len(modelo['modelo_del_par']), 'fin_historial': fin}
+    return plan, datos
+
+# === 🧾 Resúmenes mensuales de costos ===
+# Las métricas de la pestaña de costos se leen de dos tablas de resumen por mes, técnico y cliente,
+# que se mantienen en cada escritura. Guardan cantidades (horas, km, unidades) y no montos: las
+# tarifas y precios se aplican al leer, así un cambio de salario o de precio no las desactualiza.
+SQL_ROLLUP_SERVICIOS = """
+    INSERT INTO costos_mensuales (mes, id_tecnico, id_cliente, servicios, horas, km)
+    SELECT CAST(date_trunc('month', s.fecha) AS date), COALESCE(s.id_tecnico, 0), COALESCE(e.id_cliente, 0),
+           COUNT(*), COALESCE(SUM(s.duracion_horas), 0), COALESCE(SUM(s.km_recorridos), 0)
+    FROM servicios_tecnicos s
+    LEFT JOIN equipos_instalados e ON s.id_equipo = e.id_equipo
+    {filtro}
+    GROUP BY 1, 2, 3
+"""
+
+SQL_ROLLUP_CONSUMO = """
+    INSERT INTO consumo_mensual (mes, id_tecnico, id_cliente, id_repuesto, cantidad)
+    SELECT CAST(date_trunc('month', s.fecha) AS date), COALESCE(s.id_tecnico, 0), COALESCE(e.id_cliente, 0),
+           cr.id_repuesto, SUM(cr.cantidad)
+    FROM consumo_repuestos cr
+    JOIN servicios_tecnicos s ON cr.id_servicio = s.id_servicio
+    LEFT JOIN equipos_instalados e ON s.id_equipo = e.id_equipo
+    {filtro}
+    GROUP BY 1, 2, 3, 4
+"""
+
+TABLAS_RESUMEN_COSTOS = ("costos_mensuales", "consumo_mensual")
+
+def preparar_rollups_costos():
+    """Crea (si faltan) las tablas de resumen mensual y las llena si están vacías."""
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS costos_mensuales (
+                mes DATE NOT NULL,
+                id_tecnico INTEGER NOT NULL,
+                id_cliente INTEGER NOT NULL,
+                servicios BIGINT NOT NULL,
+                horas NUMERIC NOT NULL,
+                km NUMERIC NOT NULL,
+                PRIMARY KEY (mes, id_tecnico, id_cliente)
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS consumo_mensual (
+                mes DATE NOT NULL,
+                id_tecnico INTEGER NOT NULL,
+                id_cliente INTEGER NOT NULL,
+                id_repuesto INTEGER NOT NULL,
+                cantidad NUMERIC NOT NULL,
+                PRIMARY KEY (mes, id_tecnico, id_cliente, id_repuesto)
+            )
+        """))
+        # El bloqueo evita que dos preparaciones simultáneas llenen las tablas a la vez
+        conn.execute(text("LOCK TABLE costos_mensuales, consumo_mensual IN EXCLUSIVE MODE"))
+        if conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM costos_mensuales)")).scalar():
+            conn.execute(text(SQL_ROLLUP_SERVICIOS.format(filtro="")))
+            conn.execute(text("TRUNCATE consumo_mensual"))
+            conn.execute(text(SQL_ROLLUP_CONSUMO.format(filtro="")))
+    return TABLAS_RESUMEN_COSTOS
+
+def refrescar_rollups_costos(conn, meses=None):
+    """Recalcula los resúmenes de los meses dados (todos si `meses` es None) dentro de `conn`."""
+    tablas = TABLAS_RESUMEN_COSTOS
+    if meses is None:
+        borrar, filtro, params = "", "", {}
+    else:
+        borrar = "WHERE mes = ANY(:meses)"
+        filtro = "WHERE CAST(date_trunc('month', s.fecha) AS date) = ANY(:meses)"
+        params = {'meses': list(meses)}
+    for tabla in tablas:
+        conn.execute(text(f"DELETE FROM {tabla} {borrar}"), params)
+    conn.execute(text(SQL_ROLLUP_SERVICIOS.format(filtro=filtro)), params)
+    conn.execute(text(SQL_ROLLUP_CONSUMO.format(filtro=filtro)), params)
+    incrementar_versiones(conn, tablas)
+
+def reconstruir_rollups_costos():
+    """Recalcula todos los resúmenes, p. ej. tras cargar datos por fuera de la app."""
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        refrescar_rollups_costos(conn)
+    avisar_escritura()
+
+def _meses_completos(fecha_inicio, fecha_fin):
+    """Inicio del primer mes entero del rango y fin (exclusivo) del último; iguales si no hay ninguno."""
+    desde = fecha_inicio.replace(day=1)
+    if desde != fecha_inicio:
+        desde = (desde + timedelta(days=32)).replace(day=1)
+    hasta = (fecha_fin + timedelta(days=1)).replace(day=1)
+    if desde >= hasta:
+        desde = hasta = fecha_fin + timedelta(days=1)
+    return desde, hasta
+
+# === 🛠️ Confiabilidad desde el historial de servicios ===
+# Las fallas de cada equipo se cuentan en los servicios correctivos y no en los contadores de
+# equipos_instalados. Una tabla con una fila por equipo guarda fallas, primera y última falla y la
+# suma de los intervalos entre fallas, calculados con LAG sobre el historial. Cada intervalo se mide
+# desde la falla anterior o, si es posterior, desde la instalación; así la suma no depende del orden
+# en que llegan las fallas y cada servicio nuevo la actualiza sumando solo su propio tramo.
+SQL_CONFIABILIDAD = """
+    INSERT INTO confiabilidad_equipos (id_equipo, fallas, primera_falla, ultima_falla, ultimo_servicio,
+                                       dias_entre_fallas)
+    SELECT id_equipo, COUNT(*) FILTER (WHERE falla), MIN(fecha) FILTER (WHERE falla),
+           MAX(fecha) FILTER (WHERE falla), MAX(fecha), COALESCE(SUM(intervalo) FILTER (WHERE falla), 0)
+    FROM (
+        SELECT s.id_equipo, s.fecha, s.tipo_mant = 'Correctivo' AS falla,
+               GREATEST(s.fecha - GREATEST(LAG(s.fecha) OVER (
+                   PARTITION BY s.id_equipo, s.tipo_mant = 'Correctivo' ORDER BY s.fecha, s.id_servicio
+               ), e.fecha_instalacion), 0) AS intervalo
+        FROM servicios_tecnicos s
+        JOIN equipos_instalados e ON s.id_equipo = e.id_equipo
+        {filtro}
+    ) intervalos
+    GROUP BY id_equipo
+"""
+
+# Suma el servicio nuevo a la fila de su equipo. ON CONFLICT bloquea la fila y parte de su última
+# versión confirmada, así dos servicios simultáneos del mismo equipo se suman los dos.
+SQL_CONFIABILIDAD_SERVICIO = """
+    INSERT INTO confiabilidad_equipos AS f (id_equipo, fallas, primera_falla, ultima_falla, ultimo_servicio,
+                                            dias_entre_fallas)
+    SELECT id_equipo, CAST(falla AS integer), CASE WHEN falla THEN fecha END, CASE WHEN falla THEN fecha END,
+           fecha, CASE WHEN falla THEN GREATEST(fecha - fecha_instalacion, 0) ELSE 0 END
+    FROM (
+        SELECT servicio.id_equipo, servicio.fecha, e.fecha_instalacion,
+               COALESCE(servicio.tipo_mant = 'Correctivo', FALSE) AS falla
+        FROM servicio JOIN equipos_instalados e ON servicio.id_equipo = e.id_equipo
+    ) nuevo
+    ON CONFLICT (id_equipo) DO UPDATE SET
+        fallas = f.fallas + EXCLUDED.fallas,
+        primera_falla = LEAST(f.primera_falla, EXCLUDED.primera_falla),
+        ultima_falla = GREATEST(f.ultima_falla, EXCLUDED.ultima_falla),
+        ultimo_servicio = GREATEST(f.ultimo_servicio, EXCLUDED.ultimo_servicio),
+        -- Tramo desde la última falla (o la instalación) hasta la nueva; sin fecha de instalación,
+        -- una falla anterior a la primera alarga el historial desde atrás
+        dias_entre_fallas = f.dias_entre_fallas + CASE WHEN EXCLUDED.fallas = 0 THEN 0 ELSE (
+            SELECT GREATEST(EXCLUDED.ultima_falla - GREATEST(f.ultima_falla, e.fecha_instalacion), 0)
+                   + CASE WHEN e.fecha_instalacion IS NULL
+                          THEN GREATEST(f.primera_falla - EXCLUDED.ultima_falla, 0) ELSE 0 END
+            FROM equipos_instalados e WHERE e.id_equipo = f.id_equipo
+        ) END
+"""
+
+TABLA_CONFIABILIDAD = "confiabilidad_equipos"
+
+def preparar_confiabilidad():
+    """Crea (si falta) la tabla de confiabilidad por equipo y la llena si está vacía."""
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS confiabilidad_equipos (
+                id_equipo INTEGER PRIMARY KEY,
+                fallas INTEGER NOT NULL,
+                primera_falla DATE,
+                ultima_falla DATE,
+                ultimo_servicio DATE,
+                dias_entre_fallas INTEGER NOT NULL
+            )
+        """))
+        conn.execute(text("LOCK TABLE confiabilidad_equipos IN EXCLUSIVE MODE"))
+        if conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM confiabilidad_equipos)")).scalar():
+            conn.execute(text(SQL_CONFIABILIDAD.format(filtro="")))
+    return TABLA_CONFIABILIDAD
+
+def refrescar_confiabilidad(conn, equipos=None):
+    """Recalcula la confiabilidad de los equipos dados (todos si `equipos` es None) dentro de `conn`."""
+    tabla = TABLA_CONFIABILIDAD
+    if equipos is None:
+        borrar, filtro, params = "", "", {}
+    else:
+        borrar = "WHERE id_equipo = ANY(:equipos)"
+        filtro = "WHERE s.id_equipo = ANY(:equipos)"
+        params = {'equipos': [int(equipo) for equipo in equipos]}
+    conn.execute(text(f"DELETE FROM {tabla} {borrar}"), params)
+    conn.execute(text(SQL_CONFIABILIDAD.format(filtro=filtro)), params)
+    incrementar_versiones(conn, [tabla])
+
+def reconstruir_confiabilidad():
+    """Recalcula la confiabilidad de todos los equipos, p. ej. tras cargar datos por fuera de la app."""
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        refrescar_confiabilidad(conn)
+    avisar_escritura()
+
+# === 💾 Registro de servicios ===
+SECUENCIA_SERVICIOS = "servicios_tecnicos_id_servicio_seq"
+SERVICIO_INTENTOS_ID = 3
+
+def sincronizar_secuencia_servicios(conn, tablas=("servicios_tecnicos",)):
+    """Sitúa la secuencia de ids de servicio por encima del máximo id de `tablas`, sin retrocederla."""
+    maximos = ", ".join(f"(SELECT COALESCE(MAX(id_servicio), 0) FROM {tabla})" for tabla in tablas)
+    conn.execute(text(f"""
+        SELECT setval('{SECUENCIA_SERVICIOS}', GREATEST(
+            {maximos},
+            (SELECT last_value FROM {SECUENCIA_SERVICIOS})
+        ))
+    """))
+
+@st.cache_resource
+def preparar_secuencia_servicios():
+    """Crea (si falta) la secuencia de ids de servicio y la sitúa por encima del máximo existente."""
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {SECUENCIA_SERVICIOS}"))
+        sincronizar_secuencia_servicios(conn)
+    return SECUENCIA_SERVICIOS
+
+def registrar_servicio(servicio, repuestos_usados):
+    """Inserta el servicio y sus repuestos en una sola sentencia y devuelve el id registrado.
+
+    Si `servicio['id_servicio']` es None, el id se toma de la secuencia de servicios; si choca con un
+    id ingresado a mano, la secuencia se resitúa sobre el máximo y se reintenta. Devuelve None si el
+    id no pudo insertarse.
+    """
+    params = dict(servicio)
+    if servicio['id_servicio'] is None:
+        id_expr = f"nextval('{preparar_secuencia_servicios()}')"
+        intentos = SERVICIO_INTENTOS_ID
+    else:
+        id_expr = ":id_servicio"
+        intentos = 1
     
-    # Calcular próximas fallas estimadas
-    proximas_fallas = []
-    alertas = []
+    consumo = ""
+    if repuestos_usados:
+        valores = []
+        for i, repuesto in enumerate(repuestos_usados):
+            valores.append(f"(:id_repuesto_{i}, :cantidad_{i})")
+            params[f'id_repuesto_{i}'] = repuesto['id_repuesto']
+            params[f'cantidad_{i}'] = repuesto['cantidad']
+        consumo = f"""
+        , consumo AS (
+            INSERT INTO consumo_repuestos (id_servicio, id_repuesto, cantidad)
+            SELECT servicio.id_servicio, r.id_repuesto, r.cantidad
+            FROM servicio, (VALUES {', '.join(valores)}) AS r (id_repuesto, cantidad)
+            ON CONFLICT (id_servicio, id_repuesto) DO NOTHING
+            RETURNING id_repuesto, cantidad
+        )
+        , resumen_consumo AS (
+            INSERT INTO consumo_mensual (mes, id_tecnico, id_cliente, id_repuesto, cantidad)
+            SELECT k.mes, k.id_tecnico, k.id_cliente, consumo.id_repuesto, COALESCE(consumo.cantidad, 0)
+            FROM consumo, clave_resumen k
+            ON CONFLICT (mes, id_tecnico, id_cliente, id_repuesto) DO UPDATE SET
+                cantidad = consumo_mensual.cantidad + EXCLUDED.cantidad
+        )"""
     
-    for _, row in df_equipos.iterrows():
-        mtbf = row['mtbf_dias']
-        fecha_ultima = row['fecha_ultima_falla_dt']
-        fecha_inst = pd.to_datetime(row['fecha_instalacion'])
-        
-        proxima_fecha = None
-        if pd.notna(mtbf) and mtbf > 0:
-            if pd.notna(fecha_ultima):
-                proxima_fecha = fecha_ultima + pd.Timedelta(days=mtbf)
-            elif pd.notna(fecha_inst):
-                proxima_fecha = fecha_inst + pd.Timedelta(days=mtbf)
-        
-        if pd.notna(proxima_fecha):
-            dias_hasta = (proxima_fecha - hoy).days
-            fecha_str = proxima_fecha.strftime('%Y-%m-%d')
-            if dias_hasta < 0:
-                texto = f"{fecha_str} (¡ya pasó!)"
-                alerta = "⚠️ CRÍTICO"
-            elif dias_hasta <= 90:
-                texto = f"{fecha_str} (~{dias_hasta:,} días)"
-                alerta = "🔴 ALTA PRIORIDAD"
-            else:
-                texto = f"{fecha_str} (~{dias_hasta:,} días)"
-                alerta = "🟡 Normal"
+    preparar_versiones_tablas()
+    params['tablas_modificadas'] = ['servicios_tecnicos', 'consumo_repuestos', *TABLAS_RESUMEN_COSTOS,
+                                    TABLA_CONFIABILIDAD]
+    sql = text(f"""
+        WITH servicio AS (
+            INSERT INTO servicios_tecnicos (id_servicio, fecha, id_tecnico, id_equipo, id_contrato, tipo_mant, duracion_horas, km_recorridos, observaciones)
+            VALUES ({id_expr}, :fecha, :id_tecnico, :id_equipo, :id_contrato, :tipo_mant, :duracion_horas, :km_recorridos, :observaciones)
+            ON CONFLICT (id_servicio) DO NOTHING
+            RETURNING id_servicio, fecha, id_tecnico, id_equipo, tipo_mant, duracion_horas, km_recorridos
+        )
+        , clave_resumen AS (
+            SELECT CAST(date_trunc('month', servicio.fecha) AS date) AS mes,
+                   COALESCE(servicio.id_tecnico, 0) AS id_tecnico, COALESCE(e.id_cliente, 0) AS id_cliente,
+                   COALESCE(servicio.duracion_horas, 0) AS horas, COALESCE(servicio.km_recorridos, 0) AS km
+            FROM servicio
+            LEFT JOIN equipos_instalados e ON servicio.id_equipo = e.id_equipo
+        )
+        , resumen AS (
+            INSERT INTO costos_mensuales (mes, id_tecnico, id_cliente, servicios, horas, km)
+            SELECT mes, id_tecnico, id_cliente, 1, horas, km FROM clave_resumen
+            ON CONFLICT (mes, id_tecnico, id_cliente) DO UPDATE SET
+                servicios = costos_mensuales.servicios + 1,
+                horas = costos_mensuales.horas + EXCLUDED.horas,
+                km = costos_mensuales.km + EXCLUDED.km
+        )
+        , confiabilidad AS ({SQL_CONFIABILIDAD_SERVICIO}
+        ){consumo}
+        , versiones AS ({SQL_INCREMENTAR_VERSIONES.format(origen="FROM servicio")})
+        SELECT id_servicio FROM servicio;
+    """)
+    
+    # Una única sentencia es atómica por sí sola: en autocommit basta un viaje a la base de datos
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for _ in range(intentos):
+            fila = conn.execute(sql, params).first()
+            if fila is not None:
+                avisar_escritura()
+                return fila[0]
+            if servicio['id_servicio'] is None:
+                # Alguien cargó ids por delante de la secuencia (a mano, otra réplica o una importación)
+                sincronizar_secuencia_servicios(conn)
+    return None
+
+# === 📤 Importación masiva ===
+IMPORTACIONES = {
+    "Servicios técnicos": {
+        'tabla': 'servicios_tecnicos',
+        'tipos': {
+            'id_servicio': 'entero', 'fecha': 'fecha', 'id_tecnico': 'entero', 'id_equipo': 'entero',
+            'id_contrato': 'entero', 'tipo_mant': 'texto', 'duracion_horas': 'numero',
+            'km_recorridos': 'numero', 'observaciones': 'texto'
+        },
+        'obligatorias': ['fecha', 'id_tecnico', 'id_equipo', 'tipo_mant'],
+        'clave': ['id_servicio'],
+        'conflicto': "ON CONFLICT (id_servicio) DO NOTHING",
+        'rechazo': "El ID de servicio ya existe",
+    },
+    "Consumo de repuestos": {
+        'tabla': 'consumo_repuestos',
+        'tipos': {'id_servicio': 'entero', 'id_repuesto': 'entero', 'cantidad': 'entero'},
+        'obligatorias': ['id_servicio', 'id_repuesto', 'cantidad'],
+        # Como en el formulario de registro, cada repuesto consumido cuenta al menos una unidad
+        'minimos': {'cantidad': 1},
+        'clave': ['id_servicio', 'id_repuesto'],
+        'conflicto': "ON CONFLICT (id_servicio, id_repuesto) DO NOTHING",
+        'rechazo': "El repuesto ya estaba registrado en ese servicio",
+    },
+    "Gastos diarios": {
+        'tabla': 'dias_tecnicos',
+        'tipos': {
+            'fecha': 'fecha', 'id_tecnico': 'entero', 'viaticos_desayuno': 'numero',
+            'viaticos_almuerzo': 'numero', 'viaticos_cena': 'numero', 'hospedaje': 'numero',
+            'parqueo': 'numero', 'otros_gastos': 'numero'
+        },
+        'obligatorias': ['fecha', 'id_tecnico'],
+        'clave': ['fecha', 'id_tecnico'],
+        'conflicto': """ON CONFLICT (fecha, id_tecnico) DO UPDATE SET
+            viaticos_desayuno = EXCLUDED.viaticos_desayuno,
+            viaticos_almuerzo = EXCLUDED.viaticos_almuerzo,
+            viaticos_cena = EXCLUDED.viaticos_cena,
+            hospedaje = EXCLUDED.hospedaje,
+            parqueo = EXCLUDED.parqueo,
+            otros_gastos = EXCLUDED.otros_gastos""",
+        'rechazo': None,
+    },
+}
+
+def leer_archivo_importacion(archivo):
+    """Lee un archivo CSV o Excel subido por el usuario."""
+    if archivo.name.lower().endswith('.xlsx'):
+        return pd.read_excel(archivo)
+    return pd.read_csv(archivo)
+
+def validar_importacion(df, tipo, maestros):
+    """Valida por columnas un archivo de importación contra los datos maestros.
+
+    Devuelve las filas válidas ya convertidas (con su número de `fila` en el archivo)
+    y un DataFrame `fila`/`error` con un renglón por cada problema encontrado.
+    """
+    spec = IMPORTACIONES[tipo]
+    tecnicos, equipos, repuestos, contratos, indices = maestros
+    faltantes = [col for col in spec['obligatorias'] if col not in df.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+    
+    datos = pd.DataFrame(index=df.index)
+    chequeos = []
+    for col, tipo_col in spec['tipos'].items():
+        original = df[col] if col in df.columns else pd.Series(pd.NA, index=df.index, dtype=object)
+        if tipo_col == 'texto':
+            datos[col] = original.astype('string').str.strip().replace("", pd.NA)
+            no_valido = pd.Series(False, index=df.index)
         else:
-            texto = "No estimable"
-            alerta = "⚪ Sin datos"
+            if tipo_col == 'fecha':
+                convertido = pd.to_datetime(original, errors='coerce')
+            else:
+                convertido = pd.to_numeric(original, errors='coerce')
+                if tipo_col == 'entero':
+                    convertido = convertido.where(convertido % 1 == 0)
+                minimo = spec.get('minimos', {}).get(col)
+                if minimo is None:
+                    chequeos.append((convertido < 0, f"'{col}' no puede ser negativo"))
+                else:
+                    chequeos.append((convertido < minimo, f"'{col}' debe ser al menos {minimo}"))
+            datos[col] = convertido
+            no_valido = original.notna() & convertido.isna()
+            chequeos.append((no_valido, f"Valor no válido en '{col}'"))
+        if col in spec['obligatorias']:
+            chequeos.append((datos[col].isna() & ~no_valido, f"Falta '{col}'"))
+    
+    referencias = {
+        'id_tecnico': (tecnicos['id_tecnico'], "Técnico inexistente o inactivo"),
+        'id_equipo': (equipos['id_equipo'], "Equipo inexistente o inactivo"),
+        'id_repuesto': (repuestos['id_repuesto'], "Repuesto inexistente"),
+        'id_contrato': (contratos['id_contrato'], "Contrato inexistente o inactivo"),
+    }
+    for col, (validos, mensaje) in referencias.items():
+        if col in datos.columns:
+            chequeos.append((datos[col].notna() & ~datos[col].isin(validos), mensaje))
+    
+    if 'id_contrato' in datos.columns:
+        cliente_equipo = datos['id_equipo'].map(indices['cliente_por_equipo'])
+        cliente_contrato = datos['id_contrato'].map(dict(zip(contratos['id_contrato'], contratos['id_cliente'])))
+        chequeos.append((
+            cliente_equipo.notna() & cliente_contrato.notna() & (cliente_equipo != cliente_contrato),
+            "El contrato no pertenece al cliente del equipo"
+        ))
+    if 'tipo_mant' in datos.columns:
+        chequeos.append((
+            datos['tipo_mant'].notna() & ~datos['tipo_mant'].isin(["Preventivo", "Correctivo"]),
+            "'tipo_mant' debe ser Preventivo o Correctivo"
+        ))
+    
+    clave_completa = datos[spec['clave']].notna().all(axis=1)
+    chequeos.append((
+        clave_completa & datos.duplicated(spec['clave'], keep=False),
+        f"Clave repetida en el archivo ({', '.join(spec['clave'])})"
+    ))
+    
+    filas = pd.Series(df.index + 2, index=df.index)  # número de fila en el archivo, contando el encabezado
+    invalidas = pd.Series(False, index=df.index)
+    errores = []
+    for mascara, mensaje in chequeos:
+        mascara = mascara.fillna(False).astype(bool)
+        if mascara.any():
+            errores.append(pd.DataFrame({'fila': filas[mascara].values, 'error': mensaje}))
+            invalidas |= mascara
+    errores = (
+        pd.concat(errores, ignore_index=True).sort_values('fila', kind='stable', ignore_index=True)
+        if errores else pd.DataFrame(columns=['fila', 'error'])
+    )
+    
+    # Como en los formularios, los importes vacíos se registran en cero
+    for col, tipo_col in spec['tipos'].items():
+        if tipo_col == 'numero':
+            datos[col] = datos[col].fillna(0)
+        elif tipo_col == 'entero':
+            datos[col] = datos[col].astype('Int64')
+    
+    validas = datos[~invalidas].assign(fila=filas[~invalidas])
+    return validas, errores
+
+def cargar_importacion(validas, tipo):
+    """Carga las filas válidas con COPY a una tabla temporal y las inserta con la semántica de los formularios.
+
+    Devuelve el número de filas registradas y las filas rechazadas por la base de datos.
+    """
+    spec = IMPORTACIONES[tipo]
+    columnas = list(spec['tipos'])
+    lista_columnas = ", ".join(columnas)
+    
+    buffer = StringIO()
+    validas[columnas + ['fila']].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    
+    errores = []
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TEMP TABLE stg_importacion ON COMMIT DROP AS
+            SELECT {lista_columnas}, NULL::integer AS fila FROM {spec['tabla']} WITH NO DATA
+        """))
+        with conn.connection.cursor() as cur:
+            cur.copy_expert(
+                f"COPY stg_importacion ({lista_columnas}, fila) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        
+        if spec['tabla'] == 'servicios_tecnicos':
+            # La secuencia pasa primero por encima de los ids del archivo: los que se asignan no chocan
+            # con ellos y, tras insertar, el formulario sigue con el próximo id libre
+            secuencia = preparar_secuencia_servicios()
+            sincronizar_secuencia_servicios(conn, ("servicios_tecnicos", "stg_importacion"))
+            conn.execute(text(f"""
+                UPDATE stg_importacion SET id_servicio = nextval('{secuencia}')
+                WHERE id_servicio IS NULL
+            """))
+        elif spec['tabla'] == 'consumo_repuestos':
+            sin_servicio = conn.execute(text("""
+                DELETE FROM stg_importacion g
+                WHERE NOT EXISTS (SELECT 1 FROM servicios_tecnicos s WHERE s.id_servicio = g.id_servicio)
+                RETURNING fila
+            """)).scalars().all()
+            errores += [(fila, "El servicio no existe") for fila in sin_servicio]
         
-        proximas_fallas.append(texto)
-        alertas.append(alerta)
+        cruce = " AND ".join(f"i.{col} = g.{col}" for col in spec['clave'])
+        rechazadas = conn.execute(text(f"""
+            WITH insertadas AS (
+                INSERT INTO {spec['tabla']} ({lista_columnas})
+                SELECT {lista_columnas} FROM stg_importacion
+                {spec['conflicto']}
+                RETURNING {', '.join(spec['clave'])}
+            )
+            SELECT g.fila FROM stg_importacion g
+            WHERE NOT EXISTS (SELECT 1 FROM insertadas i WHERE {cruce})
+        """)).scalars().all()
+        errores += [(fila, spec['rechazo']) for fila in rechazadas]
+        incrementar_versiones(conn, [spec['tabla']])
+        if spec['tabla'] in ('servicios_tecnicos', 'consumo_repuestos'):
+            meses = conn.execute(text("""
+                SELECT DISTINCT CAST(date_trunc('month', s.fecha) AS date)
+                FROM stg_importacion g JOIN servicios_tecnicos s ON g.id_servicio = s.id_servicio
+            """)).scalars().all()
+            refrescar_rollups_costos(conn, meses)
+        if spec['tabla'] == 'servicios_tecnicos':
+            equipos = conn.execute(text("""
+                SELECT DISTINCT s.id_equipo
+                FROM stg_importacion g JOIN servicios_tecnicos s ON g.id_servicio = s.id_servicio
+            """)).scalars().all()
+            refrescar_confiabilidad(conn, equipos)
+    avisar_escritura()
     
-    df_equipos['Próxima falla estimada'] = proximas_fallas
-    df_equipos['Prioridad'] = alertas
+    errores = pd.DataFrame(errores, columns=['fila', 'error'])
+    return len(validas) - len(errores), errores
+
+# === 🧱 Preparación de la base de datos ===
+# Las tablas de resumen, la confiabilidad y los índices de servicios se crean y se llenan con
+# `python app.py preparar`, una vez por despliegue, y no al abrir una página: el llenado recorre
+# todo el historial y no cabe en el statement_timeout de una consulta de la interfaz. Las páginas
+# solo leen; si falta algo, lo avisan en lugar de crearlo.
+TABLAS_PREPARADAS = TABLAS_RESUMEN_COSTOS + (TABLA_CONFIABILIDAD,)
+
+INDICES_SERVICIOS = {
+    # Para paginar el detalle de costos por (fecha, id_servicio)
+    'servicios_tecnicos_fecha_id': "(fecha, id_servicio)",
+    # Para recalcular la confiabilidad de un equipo sin recorrer todo el historial
+    'servicios_tecnicos_equipo_fecha': "(id_equipo, fecha)",
+}
+
+def preparar_indices_servicios():
+    """Crea los índices de servicios_tecnicos que falten sin bloquear las escrituras (CONCURRENTLY)."""
+    # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET statement_timeout = 0"))
+        try:
+            # Un CONCURRENTLY interrumpido deja el índice inválido, y IF NOT EXISTS lo daría por hecho
+            invalidos = conn.execute(text("""
+                SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE NOT i.indisvalid AND c.relname = ANY(:nombres)
+            """), {'nombres': list(INDICES_SERVICIOS)}).scalars().all()
+            for nombre in invalidos:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}"))
+            for nombre, columnas in INDICES_SERVICIOS.items():
+                conn.execute(text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON servicios_tecnicos {columnas}"
+                ))
+        finally:
+            conn.execute(text("RESET statement_timeout"))
+    return tuple(INDICES_SERVICIOS)
+
+def preparar_base_datos():
+    """Crea y llena lo que falte de la base de datos; se puede repetir sin efecto si ya está todo."""
+    tiempos = {}
+    for paso in (preparar_versiones_tablas, preparar_rollups_costos, preparar_confiabilidad,
+                 preparar_indices_servicios):
+        inicio = time.perf_counter()
+        paso()
+        tiempos[paso.__name__] = time.perf_counter() - inicio
+    tablas_sin_preparar.clear()
+    return tiempos
+
+@st.cache_data(ttl=VERSIONES_INTERVALO, show_spinner=False)
+def tablas_sin_preparar():
+    """Tablas de TABLAS_PREPARADAS que todavía no existen en la base de datos."""
+    with conexion_lectura('tablas_sin_preparar') as conn:
+        return conn.execute(text("""
+            SELECT tabla FROM unnest(CAST(:tablas AS text[])) AS tabla WHERE to_regclass(tabla) IS NULL
+        """), {'tablas': list(TABLAS_PREPARADAS)}).scalars().all()
+
+def falta_preparar(*tablas):
+    """Si falta alguna de `tablas`, lo avisa en la página y devuelve True."""
+    faltan = [tabla for tabla in tablas_sin_preparar() if tabla in tablas]
+    if faltan:
+        st.error(f"❌ Faltan las tablas {', '.join(faltan)}: ejecuta `python app.py preparar` para crearlas.")
+    return bool(faltan)
+
+# === 🌙 Precálculo sin interfaz ===
+# Importar este módulo no dibuja nada, así que las cargas y los cálculos se pueden usar desde otro
+# script. `python app.py precalcular` recalcula las instantáneas de las cargas pesadas, cada una en
+# su propio proceso, y el dashboard las encuentra listas en vez de calcularlas al abrirse.
+# Pensado para correr de noche (cron o similar) contra el mismo directorio de [cache].
+
+def _iniciar_proceso_precalculo():
+    """Cada proceso abre sus propias conexiones y relee las versiones: no hereda las del padre."""
+    engine.dispose(close=False)
+    leer_versiones_tablas.clear()
+
+def _precalcular_carga(carga):
+    inicio = time.perf_counter()
+    df = PRECALCULABLES[carga]()
+    return {'filas': len(df), 'mb': memoria_df(df) / 2**20, 'segundos': time.perf_counter() - inicio}
+
+def precalcular_instantaneas(cargas=None, procesos=None):
+    """Recalcula las instantáneas de `cargas` (todas por defecto) en procesos paralelos.
+
+    Devuelve {carga: resumen, o la excepción si falló}; una carga que falla no detiene a las demás.
+    """
+    cargas = list(cargas or PRECALCULABLES)
+    procesos = procesos or min(len(cargas), os.cpu_count() or 1)
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso_precalculo) as ejecutor:
+        futuros = {carga: ejecutor.submit(_precalcular_carga, carga) for carga in cargas}
+        for carga, futuro in futuros.items():
+            try:
+                resultados[carga] = futuro.result()
+            except Exception as error:
+                resultados[carga] = error
+    return resultados
+
+def _comando_preparar(args):
+    for paso, segundos in preparar_base_datos().items():
+        print(f"✅ {paso}: {segundos:.1f} s")
+    return 0
+
+def _comando_precalcular(args):
+    _comando_preparar(args)
+    if args.resumenes:
+        inicio = time.perf_counter()
+        reconstruir_rollups_costos()
+        print(f"✅ resúmenes mensuales: {time.perf_counter() - inicio:.1f} s")
+        inicio = time.perf_counter()
+        reconstruir_confiabilidad()
+        print(f"✅ confiabilidad de equipos: {time.perf_counter() - inicio:.1f} s")
+    fallidas = 0
+    for carga, resultado in precalcular_instantaneas(args.cargas, args.procesos).items():
+        if isinstance(resultado, Exception):
+            fallidas += 1
+            print(f"❌ {carga}: {resultado}", file=sys.stderr)
+        else:
+            print(f"✅ {carga}: {resultado['filas']:,} filas, {resultado['mb']:.1f} MB, "
+                  f"{resultado['segundos']:.1f} s")
+    return 1 if fallidas else 0
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos."""
+    parser = argparse.ArgumentParser(prog="python app.py", description="Motor de indicadores sin interfaz.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
     
-    def dias_a_texto(dias):
-        if pd.isna(dias) or dias <= 0:
-            return "N/A"
-        anos = dias / 365.25
-        return f"{int(dias):,} días ({anos:.1f} años)"
+    precalcular = comandos.add_parser("precalcular", help="recalcula las instantáneas de las cargas pesadas")
+    precalcular.add_argument("--cargas", nargs="+", choices=sorted(PRECALCULABLES), metavar="CARGA",
+                             help=f"cargas a recalcular (por defecto todas: {', '.join(sorted(PRECALCULABLES))})")
+    precalcular.add_argument("--procesos", type=int, help="procesos en paralelo (por defecto uno por carga, sin pasar de los CPU)")
+    precalcular.add_argument("--resumenes", action="store_true",
+                             help="reconstruye antes los resúmenes mensuales de costos y la confiabilidad de equipos")
+    precalcular.set_defaults(ejecutar=_comando_precalcular)
     
-    for col in ['dias_operativos', 'mtbf_dias', 'dias_desde_ultima_falla']:
-        if col in df_equipos.columns:
-            df_equipos[f"{col}_texto"] = df_equipos[col].apply(dias_a_texto)
+    preparar = comandos.add_parser(
+        "preparar", help="crea y llena las tablas de resumen, la confiabilidad y los índices que falten"
+    )
+    preparar.set_defaults(ejecutar=_comando_preparar)
     
-    return df_equipos
+    args = parser.parse_args(argv)
+    global engine
+    if engine is None:
+        try:
+            engine = init_connection()
+        except RuntimeError as error:
+            print(f"❌ {error}", file=sys.stderr)
+            return 2
+    return args.ejecutar(args)
 
 # === 🖥️ Interfaz principal con menú en el header ===
-st.title("🏥 Dashboard de Gestión Técnica")
+# Cada sección es un fragmento: interactuar con sus widgets solo vuelve a ejecutar esa sección
+def fragmento_seccion(funcion):
+    """Convierte una sección en fragmento que, antes de dibujarse, descarta las cachés con tablas cambiadas.
 
-# Menú de navegación
-tab_registro, tab_equipos, tab_stock, tab_costos = st.tabs(["📝 Registro", "📊 Equipos", "📦 Stock", "💰 Costos"])
+    Los reruns de un fragmento no pasan por interfaz(), así que cada sección sincroniza por su cuenta.
+    """
+    @functools.wraps(funcion)
+    def envoltura():
+        sincronizar_caches()
+        return funcion()
+    return st.fragment(medido('seccion')(envoltura))
 
-with tab_registro:
+@fragmento_seccion
+def seccion_registro():
     st.header("📝 Registro de Nuevos Servicios Técnicos")
+    # Cada registro actualiza los resúmenes y la confiabilidad en la misma transacción
+    if falta_preparar(*TABLAS_PREPARADAS):
+        return
     
     # Cargar datos maestros
-    tecnicos, equipos, repuestos, contratos = cargar_datos_maestros()
+    tecnicos, equipos, repuestos, contratos, indices = cargar_datos_maestros()
+    indices_busqueda = cargar_indices_busqueda()
     
     # Formulario de registro
     col1, col2 = st.columns(2)
     
     with col1:
-        # ¡IMPORTANTE! Campo para id_servicio definido por el usuario
-        id_servicio = st.number_input("ID del servicio", min_value=1, step=1, 
-                                    help="Número único que identifica este servicio")
+        id_automatico = st.checkbox("Asignar ID del servicio automáticamente", value=True)
+        if id_automatico:
+            id_servicio = None
+        else:
+            id_servicio = st.number_input("ID del servicio", min_value=1, step=1, 
+                                        help="Número único que identifica este servicio")
         fecha_servicio = st.date_input("Fecha del servicio", value=date.today())
         tecnico_seleccionado = st.selectbox("Técnico", options=tecnicos['id_tecnico'], 
-                                          format_func=lambda x: tecnicos[tecnicos['id_tecnico']==x]['nombre'].iloc[0])
-        equipo_seleccionado = st.selectbox("Equipo", options=equipos['id_equipo'],
-                                         format_func=lambda x: f"{x} - {equipos[equipos['id_equipo']==x]['nombre_modelo'].iloc[0]} ({equipos[equipos['id_equipo']==x]['nombre_cliente'].iloc[0]})")
+                                          format_func=lambda x: indices['tecnicos'][x])
+        equipo_seleccionado = selector_con_busqueda("Equipo", indices_busqueda['equipos'],
+                                                    format_func=lambda x: indices['equipos'][x],
+                                                    key="equipo")
         tipo_mant = st.selectbox("Tipo de mantenimiento", ["Preventivo", "Correctivo"])
         duracion_horas = st.number_input("Duración (horas)", min_value=0.0, step=0.5)
         km_recorridos = st.number_input("Kilómetros recorridos", min_value=0.0, step=1.0)
     
     with col2:
         # Buscar contrato asociado al equipo
-        cliente_equipo = equipos[equipos['id_equipo']==equipo_seleccionado]['id_cliente'].iloc[0]
-        contratos_equipo = contratos[contratos['id_cliente']==cliente_equipo]
-        if not contratos_equipo.empty:
-            contrato_seleccionado = st.selectbox("Contrato", options=contratos_equipo['id_contrato'])
+        cliente_equipo = indices['cliente_por_equipo'].get(equipo_seleccionado)
+        contratos_equipo = indices['contratos_por_cliente'].get(cliente_equipo, [])
+        if contratos_equipo:
+            contrato_seleccionado = st.selectbox("Contrato", options=contratos_equipo)
         else:
             contrato_seleccionado = None
             st.warning("No hay contratos asociados a este cliente")
@@ -313,61 +2308,40 @@ with tab_registro:
     for i in range(num_repuestos):
         col_r1, col_r2 = st.columns(2)
         with col_r1:
-            repuesto_id = st.selectbox(f"Repuesto {i+1}", options=repuestos['id_repuesto'],
-                                     format_func=lambda x: repuestos[repuestos['id_repuesto']==x]['descripcion'].iloc[0],
-                                     key=f"repuesto_{i}")
+            repuesto_id = selector_con_busqueda(f"Repuesto {i+1}", indices_busqueda['repuestos'],
+                                                format_func=lambda x: indices['repuestos'][x],
+                                                key=f"repuesto_{i}")
         with col_r2:
             cantidad = st.number_input(f"Cantidad {i+1}", min_value=1, value=1, key=f"cantidad_{i}")
         repuestos_usados.append({'id_repuesto': repuesto_id, 'cantidad': cantidad})
     
     # Botón de registro
     if st.button("💾 Registrar Servicio"):
-        try:
-            # Validar que el id_servicio no exista
-            with engine.connect() as conn:
-                existe = pd.read_sql(
-                    "SELECT 1 FROM servicios_tecnicos WHERE id_servicio = %s", 
-                    conn, params=[id_servicio]
-                )
-            
-            if not existe.empty:
-                st.error(f"❌ El ID de servicio {id_servicio} ya existe. Usa un ID diferente.")
-            else:
-                # Insertar servicio técnico
-                with engine.begin() as conn:
-                    conn.execute(text("""
-                        INSERT INTO servicios_tecnicos (id_servicio, fecha, id_tecnico, id_equipo, id_contrato, tipo_mant, duracion_horas, km_recorridos, observaciones)
-                        VALUES (:id_servicio, :fecha, :id_tecnico, :id_equipo, :id_contrato, :tipo_mant, :duracion_horas, :km_recorridos, :observaciones);
-                    """), {
-                        'id_servicio': int(id_servicio),
-                        'fecha': fecha_servicio,
-                        'id_tecnico': tecnico_seleccionado,
-                        'id_equipo': equipo_seleccionado,
-                        'id_contrato': contrato_seleccionado,
-                        'tipo_mant': tipo_mant,
-                        'duracion_horas': duracion_horas,
-                        'km_recorridos': km_recorridos,
-                        'observaciones': observaciones
-                    })
-                    
-                    # Insertar repuestos usados
-                    for repuesto in repuestos_usados:
-                        conn.execute(text("""
-                            INSERT INTO consumo_repuestos (id_servicio, id_repuesto, cantidad)
-                            VALUES (:id_servicio, :id_repuesto, :cantidad)
-                            ON CONFLICT (id_servicio, id_repuesto) DO NOTHING;
-                        """), {
-                            'id_servicio': int(id_servicio),
-                            'id_repuesto': repuesto['id_repuesto'],
-                            'cantidad': repuesto['cantidad']
-                        })
+        if equipo_seleccionado is None or any(r['id_repuesto'] is None for r in repuestos_usados):
+            st.error("❌ Selecciona el equipo y todos los repuestos antes de registrar el servicio.")
+        else:
+            try:
+                id_registrado = registrar_servicio({
+                    'id_servicio': None if id_servicio is None else int(id_servicio),
+                    'fecha': fecha_servicio,
+                    'id_tecnico': tecnico_seleccionado,
+                    'id_equipo': equipo_seleccionado,
+                    'id_contrato': contrato_seleccionado,
+                    'tipo_mant': tipo_mant,
+                    'duracion_horas': duracion_horas,
+                    'km_recorridos': km_recorridos,
+                    'observaciones': observaciones
+                }, repuestos_usados)
                 
-                st.success(f"✅ Servicio registrado exitosamente con ID: {id_servicio}")
-                # Limpiar el formulario (opcional)
-                st.experimental_rerun()
+                if id_registrado is None and id_servicio is not None:
+                    st.error(f"❌ El ID de servicio {id_servicio} ya existe. Usa un ID diferente.")
+                elif id_registrado is None:
+                    st.error("❌ No se pudo asignar un ID al servicio. Intenta registrarlo de nuevo.")
+                else:
+                    st.success(f"✅ Servicio registrado exitosamente con ID: {id_registrado}")
             
-        except Exception as e:
-            st.error(f"❌ Error al registrar el servicio: {str(e)}")
+            except Exception as e:
+                st.error(f"❌ Error al registrar el servicio: {str(e)}")
     
     # Registro de gastos diarios
     st.header("🍽️ Registro de Gastos Diarios")
@@ -376,7 +2350,7 @@ with tab_registro:
     with col_g1:
         fecha_gastos = st.date_input("Fecha de gastos", value=date.today(), key="fecha_gastos")
         tecnico_gastos = st.selectbox("Técnico", options=tecnicos['id_tecnico'], 
-                                    format_func=lambda x: tecnicos[tecnicos['id_tecnico']==x]['nombre'].iloc[0],
+                                    format_func=lambda x: indices['tecnicos'][x],
                                     key="tecnico_gastos")
     
     with col_g2:
@@ -410,15 +2384,58 @@ with tab_registro:
                     'parqueo': parqueo,
                     'otros_gastos': otros_gastos
                 })
+                incrementar_versiones(conn, ['dias_tecnicos'])
+            avisar_escritura()
             
             st.success("✅ Gastos diarios registrados exitosamente")
             
         except Exception as e:
             st.error(f"❌ Error al registrar los gastos: {str(e)}")
+    
+    # Importación masiva desde archivo
+    st.header("📤 Importación Masiva")
+    st.caption("Carga servicios, repuestos consumidos o gastos diarios desde un archivo CSV o Excel")
+    
+    tipo_importacion = st.selectbox("Tipo de datos", options=list(IMPORTACIONES))
+    st.caption("Columnas: " + ", ".join(IMPORTACIONES[tipo_importacion]['tipos']))
+    archivo_importacion = st.file_uploader("Archivo", type=["csv", "xlsx"], key="archivo_importacion")
+    
+    if archivo_importacion is not None:
+        try:
+            filas_validas, errores_importacion = validar_importacion(
+                leer_archivo_importacion(archivo_importacion), tipo_importacion,
+                (tecnicos, equipos, repuestos, contratos, indices)
+            )
+        except ValueError as e:
+            st.error(f"❌ {str(e)}")
+        else:
+            st.info(f"{len(filas_validas)} filas válidas, {errores_importacion['fila'].nunique()} filas con errores")
+            if st.button("💾 Importar filas válidas", disabled=filas_validas.empty):
+                try:
+                    registradas, rechazadas = cargar_importacion(filas_validas, tipo_importacion)
+                    errores_importacion = pd.concat([errores_importacion, rechazadas], ignore_index=True)
+                    st.success(f"✅ {registradas} filas importadas exitosamente")
+                except Exception as e:
+                    st.error(f"❌ Error al importar el archivo: {str(e)}")
+            
+            if not errores_importacion.empty:
+                errores_importacion = errores_importacion.sort_values('fila', kind='stable')
+                st.dataframe(errores_importacion)
+                st.download_button(
+                    label="📥 Descargar reporte de errores (CSV)",
+                    data=errores_importacion.to_csv(index=False).encode('utf-8'),
+                    file_name="errores_importacion.csv",
+                    mime="text/csv"
+                )
+
+EQUIPOS_FILAS_POR_PAGINA = 500
 
-with tab_equipos:
+@fragmento_seccion
+def seccion_equipos():
     st.header("📊 Indicadores de Equipos Médicos")
     st.caption("Confiabilidad, MTBF y alertas predictivas")
+    if falta_preparar(TABLA_CONFIABILIDAD):
+        return
     
     df_equipos = cargar_indicadores_equipos()
     
@@ -442,8 +2459,8 @@ with tab_equipos:
         (df_equipos['nombre_modelo'].isin(modelo_filtro))
     ]
 
-    criticos = len(df_filtrado[df_filtrado['Prioridad'] == '⚠️ CRÍTICO'])
-    altas = len(df_filtrado[df_filtrado['Prioridad'] == '🔴 ALTA PRIORIDAD'])
+    criticos = int((df_filtrado['Prioridad'] == PRIORIDADES[0]).sum())
+    altas = int((df_filtrado['Prioridad'] == PRIORIDADES[1]).sum())
 
     col1, col2, col3 = st.columns(3)
     col1.metric("Equipos críticos", criticos)
@@ -462,22 +2479,41 @@ with tab_equipos:
         'dias_desde_ultima_falla_texto': 'Días desde última falla'
     })
 
-    def resaltar_prioridad(val):
-        color = 'lightcoral' if 'CRÍTICO' in val or 'ALTA' in val else 'white'
-        return f'background-color: {color}'
+    def resaltar_prioridad(prioridad):
+        return np.where(prioridad.isin(PRIORIDADES_URGENTES),
+                        'background-color: lightcoral', 'background-color: white')
 
-    st.dataframe(df_display.style.applymap(resaltar_prioridad, subset=['Prioridad']))
+    # Se estiliza y envía solo la página visible; las filas ya vienen ordenadas por urgencia
+    filtros = (tuple(prioridad_filtro), tuple(modelo_filtro))
+    if st.session_state.get('equipos_filtros') != filtros:
+        st.session_state['equipos_filtros'] = filtros
+        st.session_state['equipos_pagina'] = 0
+    paginas = max(-(-len(df_display) // EQUIPOS_FILAS_POR_PAGINA), 1)
+    pagina = min(st.session_state['equipos_pagina'], paginas - 1)
+    inicio = pagina * EQUIPOS_FILAS_POR_PAGINA
+    df_pagina = df_display.iloc[inicio:inicio + EQUIPOS_FILAS_POR_PAGINA]
+    
+    with medir('estilo', 'tabla_equipos'):
+        st.dataframe(df_pagina.style.apply(resaltar_prioridad, subset=['Prioridad']))
+    
+    if paginas > 1:
+        col_ant, col_pag, col_sig = st.columns([1, 2, 1])
+        col_pag.caption(f"Página {pagina + 1} de {paginas} • filas {inicio + 1:,}–{inicio + len(df_pagina):,}")
+        col_ant.button("◀ Anterior", key="equipos_anterior", disabled=pagina == 0,
+                       on_click=st.session_state.update, kwargs={'equipos_pagina': pagina - 1})
+        col_sig.button("Siguiente ▶", key="equipos_siguiente", disabled=pagina == paginas - 1,
+                       on_click=st.session_state.update, kwargs={'equipos_pagina': pagina + 1})
 
-    # Descarga en Excel
-    excel_data = to_excel({"Indicadores_Equipos": df_display})
-    st.download_button(
-        label="📥 Descargar datos (Excel)",
-        data=excel_data,
-        file_name="indicadores_tecnicos.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    # Descarga bajo demanda
+    clave = clave_exportacion('cargar_indicadores_equipos', *filtros)
+    boton_descarga_diferida(
+        "datos", "indicadores_tecnicos",
+        lambda formato: exportar_tabla(clave, formato, "Indicadores_Equipos", df_display),
+        version=clave, key="exportar_equipos"
     )
 
-with tab_stock:
+@fragmento_seccion
+def seccion_stock():
     st.header("📦 Análisis de Stock de Repuestos")
     st.caption("Basado en política de stock, compatibilidad y equipos instalados")
     
@@ -511,16 +2547,9 @@ with tab_stock:
         top10 = df_filtrado.nlargest(10, 'deficit')
         if not top10.empty:
             st.subheader("🔝 Top 10 Repuestos por Déficit")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            bars = ax.barh(top10['descripcion'], top10['deficit'], color='steelblue')
-            ax.set_xlabel('Déficit (unidades)')
-            ax.set_title('Repuestos que requieren reposición urgente')
-            for bar in bars:
-                width = bar.get_width()
-                ax.text(width + 0.1, bar.get_y() + bar.get_height()/2, 
-                        f'{int(width)}', va='center', ha='left')
-            plt.tight_layout()
-            st.pyplot(fig)
+            st.image(grafico_deficit(
+                tuple(top10['descripcion'].astype(str)), tuple(top10['deficit'].astype(float))
+            ))
         
         # Tabla detallada
         columnas_mostrar = [
@@ -539,77 +2568,174 @@ with tab_stock:
         
         st.dataframe(df_display)
         
-        # Descarga en Excel
-        excel_data = to_excel({"Lista_Compra_Repuestos": df_display})
-        st.download_button(
-            label="📥 Descargar lista de compra (Excel)",
-            data=excel_data,
-            file_name="lista_compra_repuestos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # Descarga bajo demanda
+        clave = clave_exportacion('cargar_analisis_stock', tuple(tipos), tuple(criticidades))
+        boton_descarga_diferida(
+            "lista de compra", "lista_compra_repuestos",
+            lambda formato: exportar_tabla(clave, formato, "Lista_Compra_Repuestos", df_display),
+            version=clave, key="exportar_stock"
         )
 
-with tab_costos:
+    # Simulación de demanda (se calcula solo si se pide)
+    st.subheader("🎲 Planificación de reposición")
+    if st.toggle("Simular demanda futura de repuestos", key="stock_simulacion"):
+        col1, col2 = st.columns(2)
+        with col1:
+            horizonte = st.slider("Horizonte (días)", min_value=15, max_value=365, value=90, step=15,
+                                  key="simulacion_horizonte")
+        with col2:
+            nivel = st.select_slider("Nivel de servicio", options=[0.8, 0.9, 0.95, 0.99], value=0.95,
+                                     format_func=lambda n: f"{n:.0%}", key="simulacion_nivel")
+
+        if falta_preparar(TABLA_CONFIABILIDAD):
+            return
+        plan, datos = planificar_reposicion(horizonte, nivel)
+        if plan.empty:
+            st.info("No hay consumo de repuestos en el historial para simular.")
+        else:
+            col1, col2 = st.columns(2)
+            col1.metric("Repuestos en riesgo de quiebre", int((plan['prob_quiebre'] > 1 - nivel).sum()))
+            col2.metric("Unidades a pedir", f"{int(plan['cantidad_sugerida'].sum()):,}")
+            st.caption(
+                f"{datos['escenarios']:,} escenarios en {datos['segundos']:.1f} s · "
+                f"historial de {SIMULACION_DIAS_HISTORIAL} días hasta {datos['fin_historial']}"
+            )
+            df_plan = plan.assign(
+                demanda_media=plan['demanda_media'].round(2), prob_quiebre=(plan['prob_quiebre'] * 100).round(1)
+            ).rename(columns={
+                'descripcion': 'Descripción',
+                'criticidad': 'Criticidad',
+                'stock_actual': 'Stock actual',
+                'demanda_media': 'Demanda media',
+                'demanda_percentil': f'Demanda p{nivel * 100:g}',
+                'prob_quiebre': 'Prob. de quiebre (%)',
+                'stock_minimo_total': 'Stock mínimo requerido',
+                'cantidad_sugerida': 'Cantidad sugerida'
+            })
+            st.dataframe(df_plan)
+
+            clave_plan = clave_exportacion('planificar_reposicion', horizonte, nivel)
+            boton_descarga_diferida(
+                "plan de reposición", "plan_reposicion",
+                lambda formato: exportar_tabla(clave_plan, formato, "Plan_Reposicion", df_plan),
+                version=clave_plan, key="exportar_plan"
+            )
+
+@fragmento_seccion
+def seccion_costos():
     st.header("💰 Análisis de Costos Operativos")
     st.caption("Costos reales por servicio técnico")
+    if falta_preparar(*TABLAS_RESUMEN_COSTOS):
+        return
     
-    df_costos = cargar_costos_operativos()
+    opciones_tecnicos, fecha_min, fecha_max = cargar_opciones_costos()
     
-    if df_costos.empty:
+    if pd.isna(fecha_min):
         st.info("No hay datos de costos operativos disponibles.")
     else:
         # Filtros
         col1, col2 = st.columns(2)
         with col1:
-            tecnico_filtro = st.multiselect("Filtrar por técnico", options=df_costos['tecnico'].unique())
+            tecnico_filtro = st.multiselect("Filtrar por técnico", options=opciones_tecnicos)
         with col2:
-            fecha_inicio = st.date_input("Fecha inicio", value=df_costos['fecha'].min())
-            fecha_fin = st.date_input("Fecha fin", value=df_costos['fecha'].max())
+            fecha_inicio = st.date_input("Fecha inicio", value=fecha_min)
+            fecha_fin = st.date_input("Fecha fin", value=fecha_max)
         
-        # Aplicar filtros
-        df_filtrado = df_costos.copy()
-        if tecnico_filtro:
-            df_filtrado = df_filtrado[df_filtrado['tecnico'].isin(tecnico_filtro)]
-        df_filtrado = df_filtrado[(df_filtrado['fecha'] >= fecha_inicio) & (df_filtrado['fecha'] <= fecha_fin)]
+        filtros = (tuple(tecnico_filtro), fecha_inicio, fecha_fin)
+        resumen = cargar_resumen_costos(*filtros)
         
         # Métricas
         col1, col2, col3 = st.columns(3)
-        col1.metric("Total servicios", len(df_filtrado))
-        col2.metric("Costo técnico total", f"₡{df_filtrado['costo_tecnico'].sum():,.0f}")
-        col3.metric("Costo repuestos total", f"₡{df_filtrado['costo_repuestos'].sum():,.0f}")
+        col1.metric("Total servicios", int(resumen['total_servicios']))
+        col2.metric("Costo técnico total", f"₡{resumen['costo_tecnico']:,.0f}")
+        col3.metric("Costo repuestos total", f"₡{resumen['costo_repuestos']:,.0f}")
         
-        # Tabla detallada
-        df_display = df_filtrado.rename(columns={
-            'id_servicio': 'ID Servicio',
-            'fecha': 'Fecha',
-            'tecnico': 'Técnico',
-            'id_equipo': 'Equipo',
-            'nombre_cliente': 'Cliente',
-            'duracion_horas': 'Horas',
-            'km_recorridos': 'Km',
-            'costo_tecnico': 'Costo Técnico',
-            'costo_combustible': 'Costo Combustible',
-            'costo_repuestos': 'Costo Repuestos'
-        })
+        # El detalle se consulta solo si se pide; las métricas salen de los resúmenes mensuales
+        if st.toggle("📋 Ver detalle de servicios", key="costos_detalle"):
+            # Paginación por clave: se guarda el cursor de inicio de cada página visitada
+            if st.session_state.get('costos_filtros') != filtros:
+                st.session_state['costos_filtros'] = filtros
+                st.session_state['costos_cursores'] = [None]
+            cursores = st.session_state['costos_cursores']
         
-        df_display['Costo Total'] = df_display['Costo Técnico'] + df_display['Costo Combustible'] + df_display['Costo Repuestos']
+            df_pagina = cargar_pagina_costos(*filtros, cursor=cursores[-1])
+            hay_siguiente = len(df_pagina) > COSTOS_FILAS_POR_PAGINA
+            df_pagina = df_pagina.head(COSTOS_FILAS_POR_PAGINA)
         
-        st.dataframe(df_display)
+            # Tabla detallada
+            df_display = df_pagina.rename(columns={
+                'id_servicio': 'ID Servicio',
+                'fecha': 'Fecha',
+                'tecnico': 'Técnico',
+                'id_equipo': 'Equipo',
+                'nombre_cliente': 'Cliente',
+                'duracion_horas': 'Horas',
+                'km_recorridos': 'Km',
+                'costo_tecnico': 'Costo Técnico',
+                'costo_combustible': 'Costo Combustible',
+                'costo_repuestos': 'Costo Repuestos'
+            })
+        
+            df_display['Costo Total'] = df_display['Costo Técnico'] + df_display['Costo Combustible'] + df_display['Costo Repuestos']
+        
+            st.dataframe(df_display)
+        
+            col_ant, col_pag, col_sig = st.columns([1, 2, 1])
+            col_pag.caption(f"Página {len(cursores)}")
+            col_ant.button("◀ Anterior", disabled=len(cursores) == 1, on_click=cursores.pop)
+            if hay_siguiente:
+                ultima = df_pagina.iloc[-1]
+                col_sig.button("Siguiente ▶", on_click=cursores.append,
+                               args=((ultima['fecha'], int(ultima['id_servicio'])),))
+            else:
+                col_sig.button("Siguiente ▶", disabled=True)
+        
+        boton_descarga_diferida(
+            "historial filtrado", "costos_operativos",
+            lambda formato: exportar_costos(*filtros, formato),
+            version=filtros, key="exportar_costos"
+        )
         
         # Gráfico de costos
-        if not df_display.empty:
+        if resumen['total_servicios'] > 0:
             st.subheader("📊 Distribución de costos")
-            costo_total = df_display['Costo Total'].sum()
-            costo_tecnico = df_display['Costo Técnico'].sum()
-            costo_combustible = df_display['Costo Combustible'].sum()
-            costo_repuestos = df_display['Costo Repuestos'].sum()
-            
-            fig, ax = plt.subplots()
-            labels = ['Técnico', 'Combustible', 'Repuestos']
-            sizes = [costo_tecnico, costo_combustible, costo_repuestos]
-            colors = ['lightblue', 'lightgreen', 'lightcoral']
-            ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%', startangle=90)
-            ax.axis('equal')
-            st.pyplot(fig)
-
-st.markdown("---")
-st.caption("Actualizado automáticamente cada 5 minutos • Datos desde PostgreSQL en Aiven")
\ No newline at end of file
+            st.image(grafico_distribucion_costos(
+                float(resumen['costo_tecnico']),
+                float(resumen['costo_combustible']),
+                float(resumen['costo_repuestos'])
+            ))
+
+# Menú de navegación: solo se ejecuta la sección elegida
+SECCIONES = {
+    "📝 Registro": seccion_registro,
+    "📊 Equipos": seccion_equipos,
+    "📦 Stock": seccion_stock,
+    "💰 Costos": seccion_costos,
+}
+
+def interfaz():
+    """Dibuja el dashboard; Streamlit la ejecuta en cada rerun."""
+    inicio = time.perf_counter()
+    st.markdown(METAETIQUETAS, unsafe_allow_html=True)
+    st.set_page_config(**CONFIG_PAGINA)
+    st.title("🏥 Dashboard de Gestión Técnica")
+    
+    seccion = st.radio("Sección", options=list(SECCIONES), horizontal=True,
+                       label_visibility="collapsed", key="seccion")
+    SECCIONES[seccion]()
+    
+    panel_diagnostico_conexiones()
+    panel_memoria_caches()
+    panel_metricas()
+    
+    st.markdown("---")
+    st.caption("Se actualiza al registrar datos y cada 4 horas • Datos desde PostgreSQL en Aiven")
+    registrar_duracion('rerun', 'app', (time.perf_counter() - inicio) * 1000)
+    exportar_metricas_archivos()
+
+# `streamlit run app.py` abre el dashboard; `python app.py precalcular` corre el motor sin interfaz
+if __name__ == "__main__":
+    if st.runtime.exists():
+        interfaz()
+    else:
+        sys.exit(main())
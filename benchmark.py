@@ -0,0 +1,511 @@
+"""Benchmarks de la app con datos sintéticos reproducibles (misma semilla, mismos datos).
+
+`python benchmark.py cargas --db-url URL --borrar-tablas` llena la base de datos de URL a varias
+escalas y mide cada carga en frío: tiempo y memoria máxima. La escala es la cantidad de servicios
+técnicos; el resto de tablas crece en proporción. Borra y recrea las tablas de la app, así que la URL
+se pasa siempre a mano (nunca se toma de secrets ni de DB_URL) y se rechaza la base de producción.
+Con --latencia-ms cada consulta espera ese tiempo antes de ejecutarse, como contra una base de datos
+remota; con --secuencial las consultas de leer_en_paralelo van una detrás de otra, para comparar.
+
+`python benchmark.py indicadores` mide calcular_indicadores_equipos en memoria, sin base de datos,
+con 10k, 100k y 1M equipos.
+
+`python benchmark.py formulario` mide, también sin base de datos, lo que hace el formulario de registro
+en cada rerun (buscar, etiquetar las opciones y encontrar los contratos del equipo) con catálogos cada
+vez más grandes: debe mantenerse plano.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+import app
+
+BENCHMARK_ESCALAS = (1_000, 100_000, 1_000_000)
+BENCHMARK_EQUIPOS = (10_000, 100_000, 1_000_000)
+BENCHMARK_CATALOGOS = (1_000, 10_000, 100_000, 1_000_000)
+# Lo que se escribe en los buscadores del formulario; "" es el formulario recién abierto
+BUSQUEDAS_FORMULARIO = ("", "modelo 1", "hospital 12 modelo", "9")
+# Ventana de fechas de los servicios sintéticos
+SINTETICO_INICIO = date(2020, 1, 1)
+SINTETICO_DIAS = 5 * 365
+
+SQL_ESQUEMA_SINTETICO = """
+    DROP TABLE IF EXISTS versiones_tablas, costos_mensuales, consumo_mensual, confiabilidad_equipos, dias_tecnicos,
+        consumo_repuestos, servicios_tecnicos, contratos, compatibilidad, politica_stock_repuestos,
+        inventario_logistico, catalogo_repuestos, equipos_instalados, modelos, clientes, tecnicos CASCADE;
+    DROP SEQUENCE IF EXISTS servicios_tecnicos_id_servicio_seq;
+    CREATE TABLE tecnicos (id_tecnico INTEGER PRIMARY KEY, nombre TEXT, activo BOOLEAN,
+        salario_bruto NUMERIC, vehiculo_km_l NUMERIC);
+    CREATE TABLE clientes (id_cliente INTEGER PRIMARY KEY, nombre_cliente TEXT, codigo_referencia TEXT);
+    CREATE TABLE modelos (id_modelo INTEGER PRIMARY KEY, nombre_modelo TEXT, marca TEXT);
+    CREATE TABLE equipos_instalados (id_equipo INTEGER PRIMARY KEY, id_cliente INTEGER REFERENCES clientes,
+        id_modelo INTEGER REFERENCES modelos, ano_fabricacion INTEGER, fecha_instalacion DATE, zona TEXT,
+        tiempo_viaje NUMERIC, estado TEXT, tipo_contrato TEXT, tipo_cliente TEXT, observaciones TEXT,
+        fecha_ultima_falla DATE, cantidad_fallas INTEGER, dias_operativos INTEGER);
+    CREATE TABLE catalogo_repuestos (id_repuesto INTEGER PRIMARY KEY, descripcion TEXT, tipo_repuesto TEXT,
+        criticidad INTEGER, precio_unitario NUMERIC);
+    CREATE TABLE inventario_logistico (id_repuesto INTEGER REFERENCES catalogo_repuestos, stock_actual INTEGER);
+    CREATE TABLE politica_stock_repuestos (id_politica SERIAL PRIMARY KEY,
+        id_repuesto INTEGER REFERENCES catalogo_repuestos, equipos_min INTEGER, equipos_max INTEGER,
+        stock_minimo INTEGER);
+    CREATE TABLE compatibilidad (id_repuesto INTEGER REFERENCES catalogo_repuestos,
+        id_modelo INTEGER REFERENCES modelos, PRIMARY KEY (id_repuesto, id_modelo));
+    CREATE TABLE contratos (id_contrato INTEGER PRIMARY KEY, id_cliente INTEGER REFERENCES clientes, activo BOOLEAN);
+    CREATE TABLE servicios_tecnicos (id_servicio INTEGER PRIMARY KEY, fecha DATE,
+        id_tecnico INTEGER REFERENCES tecnicos, id_equipo INTEGER REFERENCES equipos_instalados,
+        id_contrato INTEGER REFERENCES contratos, tipo_mant TEXT, duracion_horas NUMERIC,
+        km_recorridos NUMERIC, observaciones TEXT);
+    CREATE TABLE consumo_repuestos (id_servicio INTEGER REFERENCES servicios_tecnicos,
+        id_repuesto INTEGER REFERENCES catalogo_repuestos, cantidad INTEGER, PRIMARY KEY (id_servicio, id_repuesto));
+    CREATE TABLE dias_tecnicos (fecha DATE, id_tecnico INTEGER REFERENCES tecnicos, viaticos_desayuno NUMERIC,
+        viaticos_almuerzo NUMERIC, viaticos_cena NUMERIC, hospedaje NUMERIC, parqueo NUMERIC,
+        otros_gastos NUMERIC, PRIMARY KEY (fecha, id_tecnico));
+"""
+
+def es_produccion(url):
+    """True si `url` apunta a la base de datos de producción o a cualquier otra de Aiven."""
+    host = (make_url(url).host or "").lower()
+    return host == app.HOST_PRODUCCION or host.endswith(".aivencloud.com")
+
+def generar_datos_sinteticos(servicios, semilla=0):
+    """Genera todas las tablas de la app para `servicios` servicios técnicos, en orden de inserción."""
+    rng = np.random.default_rng(semilla)
+    n_tec = max(5, servicios // 20_000)
+    n_cli = max(10, servicios // 1_000)
+    n_mod = max(10, min(400, servicios // 2_500))
+    n_eq = max(50, servicios // 5)
+    n_rep = max(50, servicios // 200)
+    n_consumo = servicios * 3 // 2
+    
+    def fechas(desde, dias, n):
+        return (pd.Timestamp(desde) + pd.to_timedelta(rng.integers(0, dias, n), unit='D')).date
+    
+    tablas = {}
+    tablas['tecnicos'] = pd.DataFrame({
+        'id_tecnico': np.arange(1, n_tec + 1), 'nombre': [f"Técnico {i}" for i in range(1, n_tec + 1)],
+        'activo': rng.random(n_tec) > 0.1, 'salario_bruto': rng.integers(600_000, 1_500_000, n_tec),
+        'vehiculo_km_l': rng.integers(8, 16, n_tec),
+    })
+    tablas['clientes'] = pd.DataFrame({
+        'id_cliente': np.arange(1, n_cli + 1), 'nombre_cliente': [f"Hospital {i}" for i in range(1, n_cli + 1)],
+        'codigo_referencia': [f"REF{i}" for i in range(1, n_cli + 1)],
+    })
+    tablas['modelos'] = pd.DataFrame({
+        'id_modelo': np.arange(1, n_mod + 1), 'nombre_modelo': [f"Modelo {i:03d}" for i in range(1, n_mod + 1)],
+        'marca': rng.choice(['Roche', 'Abbott', 'Sysmex', 'Siemens'], n_mod),
+    })
+    instalacion = fechas('2012-01-01', 4_000, n_eq)
+    ultima_falla = pd.Series(pd.to_datetime(instalacion) + pd.to_timedelta(rng.integers(10, 1_500, n_eq), unit='D'))
+    tablas['equipos_instalados'] = pd.DataFrame({
+        'id_equipo': np.arange(1, n_eq + 1), 'id_cliente': rng.integers(1, n_cli + 1, n_eq),
+        'id_modelo': rng.integers(1, n_mod + 1, n_eq), 'ano_fabricacion': rng.integers(2005, 2024, n_eq),
+        'fecha_instalacion': instalacion, 'zona': rng.choice(['GAM', 'Norte', 'Sur', 'Caribe'], n_eq),
+        'tiempo_viaje': rng.integers(0, 6, n_eq), 'estado': np.where(rng.random(n_eq) < 0.75, 'Activo', 'Inactivo'),
+        'tipo_contrato': rng.choice(['Full', 'Básico'], n_eq), 'tipo_cliente': rng.choice(['Público', 'Privado'], n_eq),
+        'observaciones': None, 'fecha_ultima_falla': ultima_falla.where(rng.random(n_eq) > 0.3).dt.date,
+        'cantidad_fallas': rng.integers(0, 15, n_eq), 'dias_operativos': rng.integers(0, 5_000, n_eq),
+    })
+    tablas['catalogo_repuestos'] = pd.DataFrame({
+        'id_repuesto': np.arange(1, n_rep + 1), 'descripcion': [f"Repuesto {i}" for i in range(1, n_rep + 1)],
+        'tipo_repuesto': rng.choice(['Consumible', 'Eléctrico', 'Óptico'], n_rep),
+        'criticidad': rng.integers(1, 4, n_rep), 'precio_unitario': rng.integers(1_000, 500_000, n_rep),
+    })
+    con_stock = rng.choice(np.arange(1, n_rep + 1), int(n_rep * 0.8), replace=False)
+    tablas['inventario_logistico'] = pd.DataFrame({
+        'id_repuesto': np.sort(con_stock), 'stock_actual': rng.integers(0, 30, len(con_stock)),
+    })
+    # Entre una y tres bandas contiguas por repuesto; la última queda abierta
+    bandas = rng.integers(1, 4, n_rep)
+    id_repuesto = np.repeat(np.arange(1, n_rep + 1), bandas)
+    orden = np.arange(len(id_repuesto)) - np.repeat(np.cumsum(bandas) - bandas, bandas)
+    ancho = rng.integers(1, 200, len(id_repuesto))
+    hasta = pd.Series(ancho).groupby(id_repuesto).cumsum().to_numpy()
+    tablas['politica_stock_repuestos'] = pd.DataFrame({
+        'id_repuesto': id_repuesto, 'equipos_min': hasta - ancho + 1,
+        'equipos_max': pd.Series(hasta, dtype='Int64').where(orden < np.repeat(bandas, bandas) - 1),
+        'stock_minimo': rng.integers(1, 9, len(id_repuesto)),
+    })
+    tablas['compatibilidad'] = pd.DataFrame({
+        'id_repuesto': np.repeat(np.arange(1, n_rep + 1), 4), 'id_modelo': rng.integers(1, n_mod + 1, n_rep * 4),
+    }).drop_duplicates(ignore_index=True)
+    # Dos contratos por cliente: 2c-1 y 2c
+    tablas['contratos'] = pd.DataFrame({
+        'id_contrato': np.arange(1, 2 * n_cli + 1), 'id_cliente': np.repeat(np.arange(1, n_cli + 1), 2),
+        'activo': rng.random(2 * n_cli) > 0.2,
+    })
+    id_equipo = rng.integers(1, n_eq + 1, servicios)
+    cliente = tablas['equipos_instalados']['id_cliente'].to_numpy()[id_equipo - 1]
+    tablas['servicios_tecnicos'] = pd.DataFrame({
+        'id_servicio': np.arange(1, servicios + 1), 'fecha': fechas(SINTETICO_INICIO, SINTETICO_DIAS, servicios),
+        'id_tecnico': rng.integers(1, n_tec + 1, servicios), 'id_equipo': id_equipo,
+        'id_contrato': 2 * cliente - rng.integers(0, 2, servicios),
+        'tipo_mant': rng.choice(['Preventivo', 'Correctivo'], servicios),
+        'duracion_horas': rng.integers(1, 9, servicios), 'km_recorridos': rng.integers(0, 300, servicios),
+        'observaciones': None,
+    })
+    tablas['consumo_repuestos'] = pd.DataFrame({
+        'id_servicio': rng.integers(1, servicios + 1, n_consumo), 'id_repuesto': rng.integers(1, n_rep + 1, n_consumo),
+        'cantidad': rng.integers(1, 4, n_consumo),
+    }).drop_duplicates(['id_servicio', 'id_repuesto'], ignore_index=True)
+    dias = pd.MultiIndex.from_product(
+        [pd.date_range(SINTETICO_INICIO, periods=SINTETICO_DIAS).date, np.arange(1, n_tec + 1)],
+        names=['fecha', 'id_tecnico']
+    ).to_frame(index=False)
+    dias = dias[rng.random(len(dias)) < 0.6].reset_index(drop=True)
+    gastos = ['viaticos_desayuno', 'viaticos_almuerzo', 'viaticos_cena', 'hospedaje', 'parqueo', 'otros_gastos']
+    tablas['dias_tecnicos'] = dias.assign(**{col: rng.integers(0, 20, len(dias)) * 500 for col in gastos})
+    return tablas
+
+def cargar_datos_sinteticos(tablas):
+    """Recrea las tablas de la app en la base de datos conectada y las llena con COPY."""
+    if es_produccion(app.engine.url):
+        raise RuntimeError("El benchmark no puede borrar las tablas de la base de datos de producción")
+    with app.engine.begin() as conn:
+        conn.exec_driver_sql(SQL_ESQUEMA_SINTETICO)
+        cursor = conn.connection.driver_connection.cursor()
+        for tabla, df in tablas.items():
+            for bloque in app._como_bloques(df, 200_000):
+                buffer = StringIO()
+                bloque.to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {tabla} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        conn.exec_driver_sql("SELECT setval('politica_stock_repuestos_id_politica_seq', "
+                             "(SELECT COALESCE(MAX(id_politica), 0) + 1 FROM politica_stock_repuestos), false)")
+        conn.exec_driver_sql("ANALYZE")
+    # La versión y la secuencia se vuelven a crear al usarlas; resúmenes, confiabilidad e índices,
+    # con app.preparar_base_datos() como en `python app.py preparar`
+    for preparar in (app.preparar_versiones_tablas, app.preparar_secuencia_servicios):
+        preparar.clear()
+    app.leer_versiones_tablas.clear()
+    app.tablas_sin_preparar.clear()
+
+def _resumenes_desde_cero():
+    """Construye los resúmenes mensuales de costos como la primera vez."""
+    with app.engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS costos_mensuales, consumo_mensual"))
+    return app.preparar_rollups_costos()
+
+def _confiabilidad_desde_cero():
+    """Construye la confiabilidad por equipo como la primera vez."""
+    with app.engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS confiabilidad_equipos"))
+    return app.preparar_confiabilidad()
+
+def _tareas_benchmark():
+    """{nombre: función sin argumentos} con las cargas de cada pestaña, como las llama la interfaz."""
+    desde = SINTETICO_INICIO + timedelta(days=15)
+    hasta = SINTETICO_INICIO + timedelta(days=SINTETICO_DIAS - 15)
+    return {
+        'preparar_rollups_costos': _resumenes_desde_cero,
+        'preparar_confiabilidad': _confiabilidad_desde_cero,
+        'cargar_datos_maestros': app.cargar_datos_maestros,
+        'cargar_indices_busqueda': app.cargar_indices_busqueda,
+        'cargar_analisis_stock': app.cargar_analisis_stock,
+        'cargar_indicadores_equipos': app.cargar_indicadores_equipos,
+        'cargar_opciones_costos': app.cargar_opciones_costos,
+        'cargar_resumen_costos': lambda: app.cargar_resumen_costos((), desde, hasta),
+        'cargar_pagina_costos': lambda: app.cargar_pagina_costos((), desde, hasta),
+    }
+
+def _vaciar_caches_benchmark():
+    """Deja todas las cargas en frío: sin caché en memoria y sin instantáneas."""
+    for nombre in _tareas_benchmark():
+        if nombre.startswith('cargar_'):
+            getattr(app, nombre).clear()
+    for nombre in ('analisis_stock', 'indicadores_equipos'):
+        app.borrar_instantaneas(nombre)
+
+def _filas(resultado):
+    """Filas de los DataFrames que devuelve una carga, o None si no devuelve ninguno."""
+    partes = resultado if isinstance(resultado, tuple) else (resultado,)
+    tablas = [parte for parte in partes if isinstance(parte, pd.DataFrame)]
+    return sum(len(tabla) for tabla in tablas) if tablas else None
+
+def medir_cargas(cargas=None):
+    """Mide cada carga en frío dos veces: una para el tiempo y otra, con tracemalloc, para la memoria.
+
+    La memoria es el pico de lo asignado por Python, numpy y pandas durante la carga; los buffers
+    de Arrow y de psycopg2 no se cuentan. Devuelve una lista de {carga, filas, segundos, mb_pico}.
+    """
+    import tracemalloc
+    tareas = _tareas_benchmark()
+    resultados = []
+    for nombre in cargas or tareas:
+        if not nombre.startswith('preparar_'):
+            # Se miden aparte: las cargas solo leen lo que deja `python app.py preparar`
+            app.preparar_base_datos()
+        _vaciar_caches_benchmark()
+        inicio = time.perf_counter()
+        resultado = tareas[nombre]()
+        segundos = time.perf_counter() - inicio
+        _vaciar_caches_benchmark()
+        tracemalloc.start()
+        try:
+            tareas[nombre]()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        resultados.append({'carga': nombre, 'filas': _filas(resultado), 'segundos': segundos,
+                           'mb_pico': pico / 2**20})
+    return resultados
+
+def generar_equipos_sinteticos(equipos, semilla=0):
+    """Equipos con las columnas que cargar_indicadores_equipos lee de la base de datos, tal como las devuelve."""
+    rng = np.random.default_rng(semilla)
+    
+    def fechas(desde, dias):
+        return pd.Series(pd.Timestamp(desde) + pd.to_timedelta(rng.integers(0, dias, equipos), unit='D'))
+    
+    instalacion = fechas('2012-01-01', 4_000)
+    fallas = rng.integers(0, 15, equipos)
+    con_fallas = fallas > 0
+    ultima_falla = instalacion + pd.to_timedelta(rng.integers(10, 1_500, equipos), unit='D')
+    ultimo_servicio = ultima_falla + pd.to_timedelta(rng.integers(0, 400, equipos), unit='D')
+    return pd.DataFrame({
+        'id_equipo': np.arange(1, equipos + 1),
+        'fecha_instalacion': instalacion.dt.date.where(rng.random(equipos) > 0.02),
+        'estado': np.where(rng.random(equipos) < 0.75, 'Activo', 'Inactivo'),
+        'fecha_ultima_falla': ultima_falla.dt.date.where(con_fallas),
+        'cantidad_fallas': fallas,
+        'dias_entre_fallas': pd.Series(rng.integers(0, 3_000, equipos), dtype=float).where(con_fallas),
+        'ultimo_servicio': ultimo_servicio.dt.date.where(rng.random(equipos) > 0.05),
+    })
+
+def medir_indicadores(equipos, semilla=0):
+    """Mide calcular_indicadores_equipos sobre `equipos` equipos sintéticos, como medir_cargas."""
+    import tracemalloc
+    df_equipos = generar_equipos_sinteticos(equipos, semilla)
+    hoy = SINTETICO_INICIO + timedelta(days=SINTETICO_DIAS)
+    inicio = time.perf_counter()
+    resultado = app.calcular_indicadores_equipos(df_equipos, hoy)
+    segundos = time.perf_counter() - inicio
+    del resultado
+    tracemalloc.start()
+    try:
+        app.calcular_indicadores_equipos(df_equipos, hoy)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'carga': 'calcular_indicadores_equipos', 'filas': equipos, 'segundos': segundos,
+            'mb_pico': pico / 2**20}
+
+def generar_maestros_sinteticos(equipos, semilla=0):
+    """(tecnicos, equipos, repuestos, contratos) como los devuelve cargar_datos_maestros, para `equipos` equipos."""
+    rng = np.random.default_rng(semilla)
+    n_cli = max(10, equipos // 100)
+    n_rep = max(50, equipos // 10)
+    tecnicos = pd.DataFrame({'id_tecnico': np.arange(1, 51), 'nombre': [f"Técnico {i}" for i in range(1, 51)]})
+    id_cliente = rng.integers(1, n_cli + 1, equipos)
+    df_equipos = pd.DataFrame({
+        'id_equipo': np.arange(1, equipos + 1), 'id_cliente': id_cliente,
+        'nombre_modelo': pd.Series(rng.integers(1, 401, equipos)).map("Modelo {:03d}".format),
+        'nombre_cliente': pd.Series(id_cliente).map("Hospital {}".format),
+    })
+    repuestos = pd.DataFrame({
+        'id_repuesto': np.arange(1, n_rep + 1),
+        'descripcion': pd.Series(rng.integers(1, 5_000, n_rep)).map("Repuesto tipo {}".format),
+    })
+    contratos = pd.DataFrame({'id_contrato': np.arange(1, 2 * n_cli + 1), 'id_cliente': np.repeat(np.arange(1, n_cli + 1), 2)})
+    return tecnicos, df_equipos, repuestos, contratos
+
+def medir_formulario(equipos, semilla=0, repeticiones=20):
+    """Mide la construcción de los índices del formulario y el trabajo de un rerun con `equipos` equipos.
+
+    Los índices se construyen una vez por refresco de la caché; el rerun (buscar equipo y repuesto,
+    etiquetar las opciones como los format_func y buscar los contratos) ocurre en cada interacción.
+    """
+    import tracemalloc
+    tecnicos, df_equipos, repuestos, contratos = generar_maestros_sinteticos(equipos, semilla)
+    
+    def construir():
+        return (app.construir_indices_maestros(tecnicos, df_equipos, repuestos, contratos),
+                app.construir_indices_busqueda(df_equipos, repuestos))
+    
+    inicio = time.perf_counter()
+    indices, busqueda = construir()
+    construccion = time.perf_counter() - inicio
+    
+    def rerun():
+        for consulta in BUSQUEDAS_FORMULARIO:
+            etiquetas = [indices['tecnicos'][x] for x in tecnicos['id_tecnico']]
+            opciones = app.buscar_en_indice(busqueda['equipos'], consulta)
+            etiquetas += [indices['equipos'][x] for x in opciones]
+            cliente = indices['cliente_por_equipo'].get(opciones[0] if opciones else None)
+            etiquetas += indices['contratos_por_cliente'].get(cliente, [])
+            etiquetas += [indices['repuestos'][x] for x in app.buscar_en_indice(busqueda['repuestos'], consulta)]
+    
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        rerun()
+        tiempos.append((time.perf_counter() - inicio) / len(BUSQUEDAS_FORMULARIO))
+    
+    picos = []
+    for medir in (construir, rerun):
+        tracemalloc.start()
+        try:
+            medir()
+            picos.append(tracemalloc.get_traced_memory()[1] / 2**20)
+        finally:
+            tracemalloc.stop()
+    return [
+        {'carga': 'construir_indices_formulario', 'filas': equipos, 'segundos': construccion, 'mb_pico': picos[0]},
+        {'carga': 'rerun_formulario', 'filas': equipos, 'segundos': float(np.median(tiempos)), 'mb_pico': picos[1]},
+    ]
+
+def _clave_medicion(medicion):
+    """Escala, carga y condiciones de red: solo se comparan mediciones tomadas en las mismas condiciones."""
+    return (medicion['escala'], medicion['carga'], medicion.get('latencia_ms', 0), medicion.get('secuencial', False))
+
+def comparar_benchmark(resultados, base, tolerancia):
+    """Mediciones de `resultados` más lentas o pesadas que `base` por encima de `tolerancia` (0.25 = 25 %)."""
+    previos = {_clave_medicion(r): r for r in base}
+    regresiones = []
+    for actual in resultados:
+        previo = previos.get(_clave_medicion(actual))
+        if previo is None:
+            continue
+        for metrica in ('segundos', 'mb_pico'):
+            # Diferencias de milisegundos o de unos pocos MB son ruido de medición
+            piso = 0.05 if metrica == 'segundos' else 1.0
+            if actual[metrica] > max(previo[metrica] * (1 + tolerancia), previo[metrica] + piso):
+                regresiones.append((actual['escala'], actual['carga'], metrica, previo[metrica], actual[metrica]))
+    return regresiones
+
+def simular_latencia(engine, ms):
+    """Hace que cada consulta de `engine` espere `ms` antes de ejecutarse; devuelve el listener."""
+    def esperar(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(ms / 1000)
+    event.listen(engine, "before_cursor_execute", esperar)
+    return esperar
+
+def _comando_cargas(args):
+    if not args.borrar_tablas:
+        print("❌ El benchmark borra y recrea las tablas de la app: confírmalo con --borrar-tablas", file=sys.stderr)
+        return 2
+    if es_produccion(args.db_url):
+        print("❌ --db-url apunta a la base de datos de producción: usa una base de datos local", file=sys.stderr)
+        return 2
+    # El engine de la app sale de secrets o de DB_URL; el benchmark solo usa el de --db-url
+    app.engine = app.crear_engine(args.db_url)
+    if args.secuencial:
+        # Un solo hilo: las consultas de leer_en_paralelo esperan cada una a la anterior
+        ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="consultas")
+        app._ejecutor_consultas = lambda: ejecutor
+    condiciones = {'latencia_ms': args.latencia_ms, 'secuencial': args.secuencial}
+    resultados = []
+    with tempfile.TemporaryDirectory(prefix="repuestos_benchmark_") as directorio:
+        os.environ['CACHE_DIR'] = directorio  # las instantáneas del benchmark no tocan las de la app
+        for escala in args.escalas:
+            inicio = time.perf_counter()
+            tablas = generar_datos_sinteticos(escala, args.semilla)
+            total_filas = sum(len(df) for df in tablas.values())
+            cargar_datos_sinteticos(tablas)
+            del tablas
+            print(f"📦 {escala:,} servicios: {total_filas:,} filas sintéticas cargadas en "
+                  f"{time.perf_counter() - inicio:.1f} s")
+            # La latencia se agrega después de cargar los datos: solo afecta a las mediciones
+            esperar = simular_latencia(app.engine, args.latencia_ms) if args.latencia_ms else None
+            try:
+                mediciones = medir_cargas(args.cargas)
+            finally:
+                if esperar is not None:
+                    event.remove(app.engine, "before_cursor_execute", esperar)
+            for medicion in mediciones:
+                resultados.append({'escala': escala, 'semilla': args.semilla, **condiciones, **medicion})
+                filas = f"{medicion['filas']:,}" if medicion['filas'] is not None else "—"
+                print(f"   {medicion['carga']:<28}{filas:>12} filas {medicion['segundos']:>9.2f} s "
+                      f"{medicion['mb_pico']:>9.1f} MB")
+    return _guardar_y_comparar(resultados, args, "servicios")
+
+def _guardar_y_comparar(resultados, args, unidad):
+    """Guarda las mediciones en --salida y las compara con --base; devuelve el código de salida."""
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            archivo.writelines(json.dumps(r) + "\n" for r in resultados)
+    if args.base:
+        with open(args.base, encoding="utf-8") as archivo:
+            base = [json.loads(linea) for linea in archivo if linea.strip()]
+        regresiones = comparar_benchmark(resultados, base, args.tolerancia)
+        for escala, carga, metrica, previo, actual in regresiones:
+            print(f"❌ {carga} a {escala:,} {unidad}: {metrica} {previo:.2f} → {actual:.2f}", file=sys.stderr)
+        if regresiones:
+            return 1
+        print(f"✅ Sin regresiones respecto a {args.base}")
+    return 0
+
+def _comando_indicadores(args):
+    resultados = []
+    for escala in args.escalas:
+        medicion = medir_indicadores(escala, args.semilla)
+        resultados.append({'escala': escala, 'semilla': args.semilla, **medicion})
+        print(f"🩺 {escala:>12,} equipos {medicion['segundos']:>9.2f} s {medicion['mb_pico']:>9.1f} MB")
+    return _guardar_y_comparar(resultados, args, "equipos")
+
+def _comando_formulario(args):
+    resultados = []
+    for escala in args.escalas:
+        for medicion in medir_formulario(escala, args.semilla):
+            resultados.append({'escala': escala, 'semilla': args.semilla, **medicion})
+            print(f"📝 {escala:>12,} equipos  {medicion['carga']:<30}{medicion['segundos'] * 1000:>10.2f} ms "
+                  f"{medicion['mb_pico']:>9.1f} MB")
+    return _guardar_y_comparar(resultados, args, "equipos")
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos."""
+    parser = argparse.ArgumentParser(prog="python benchmark.py", description="Benchmark de la app con datos sintéticos.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    
+    # --salida, --base y --tolerancia valen para todos los comandos
+    comunes = argparse.ArgumentParser(add_help=False)
+    comunes.add_argument("--semilla", type=int, default=0, help="semilla del generador (por defecto %(default)s)")
+    comunes.add_argument("--salida", help="guarda las mediciones en este archivo JSON Lines")
+    comunes.add_argument("--base", help="compara con mediciones previas (JSON Lines) y falla si hay regresiones")
+    comunes.add_argument("--tolerancia", type=float, default=0.25,
+                         help="aumento admitido respecto a --base (por defecto %(default)s = 25 %%)")
+    
+    cargas = comandos.add_parser("cargas", parents=[comunes],
+                                 help="mide las cargas de la app con datos sintéticos en la base de --db-url")
+    cargas.add_argument("--db-url", required=True,
+                        help="base de datos desechable donde generar los datos (se borran sus tablas)")
+    cargas.add_argument("--borrar-tablas", action="store_true",
+                        help="confirma que se pueden borrar y recrear las tablas de --db-url")
+    cargas.add_argument("--escalas", nargs="+", type=int, default=list(BENCHMARK_ESCALAS), metavar="SERVICIOS",
+                        help="cantidades de servicios técnicos a generar (por defecto %(default)s)")
+    cargas.add_argument("--cargas", nargs="+", choices=list(_tareas_benchmark()), metavar="CARGA",
+                        help="cargas a medir (por defecto todas)")
+    cargas.add_argument("--latencia-ms", type=float, default=0,
+                        help="espera antes de cada consulta, para simular una base de datos remota "
+                             "(por defecto %(default)s)")
+    cargas.add_argument("--secuencial", action="store_true",
+                        help="ejecuta una por una las consultas que la app lanza en paralelo")
+    cargas.set_defaults(ejecutar=_comando_cargas)
+    
+    indicadores = comandos.add_parser("indicadores", parents=[comunes],
+                                      help="mide calcular_indicadores_equipos en memoria, sin base de datos")
+    indicadores.add_argument("--escalas", nargs="+", type=int, default=list(BENCHMARK_EQUIPOS), metavar="EQUIPOS",
+                             help="cantidades de equipos a generar (por defecto %(default)s)")
+    indicadores.set_defaults(ejecutar=_comando_indicadores)
+    
+    formulario = comandos.add_parser("formulario", parents=[comunes],
+                                     help="mide un rerun del formulario de registro en memoria, sin base de datos")
+    formulario.add_argument("--escalas", nargs="+", type=int, default=list(BENCHMARK_CATALOGOS), metavar="EQUIPOS",
+                            help="cantidades de equipos del catálogo (por defecto %(default)s)")
+    formulario.set_defaults(ejecutar=_comando_formulario)
+    
+    args = parser.parse_args(argv)
+    return args.ejecutar(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
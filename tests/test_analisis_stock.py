@@ -0,0 +1,88 @@
+"""Paridad del análisis de stock en el servidor (SQL_ANALISIS_STOCK) con el cálculo en pandas.
+
+Necesita una base de datos PostgreSQL desechable en TEST_DB_URL: se borran y recrean sus tablas
+con los datos sintéticos del benchmark. Sin TEST_DB_URL los tests se saltan.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+import benchmark
+
+TEST_DB_URL = os.environ.get('TEST_DB_URL')
+pytestmark = pytest.mark.skipif(not TEST_DB_URL, reason="fija TEST_DB_URL con una base de datos desechable")
+
+
+@pytest.fixture
+def base_sintetica(monkeypatch):
+    """Apunta la app a TEST_DB_URL y devuelve una función que carga las tablas sintéticas."""
+    if benchmark.es_produccion(TEST_DB_URL):
+        pytest.fail("TEST_DB_URL apunta a la base de datos de producción")
+    monkeypatch.setattr(app, 'engine', app.crear_engine(TEST_DB_URL))
+    yield benchmark.cargar_datos_sinteticos
+    app.engine.dispose()
+
+
+def analisis_en_servidor():
+    with app.engine.connect() as conn:
+        return pd.read_sql(app.SQL_ANALISIS_STOCK, conn)
+
+
+def comparar(servidor, pandas):
+    """Compara los dos resultados fila a fila, sin depender del orden entre déficits iguales."""
+    servidor = servidor.sort_values('id_repuesto', ignore_index=True)
+    pandas = pandas[servidor.columns].sort_values('id_repuesto', ignore_index=True)
+    pd.testing.assert_frame_equal(servidor, pandas, check_dtype=False)
+
+
+@pytest.mark.parametrize("servicios", [1_000, 100_000])
+def test_paridad_con_pandas_en_datos_sinteticos(base_sintetica, servicios):
+    base_sintetica(benchmark.generar_datos_sinteticos(servicios, semilla=servicios))
+
+    servidor = analisis_en_servidor()
+
+    assert len(servidor) > 0
+    comparar(servidor, app._analisis_stock_pandas())
+
+
+def test_paridad_con_bandas_solapadas(base_sintetica):
+    tablas = benchmark.generar_datos_sinteticos(1_000, semilla=1)
+    # Una banda abierta más por repuesto que solapa con las anteriores. Se inserta al final de la
+    # tabla pero con id_politica menor, así que gana ella: cuenta el id, no el orden físico
+    politica = tablas['politica_stock_repuestos']
+    repuestos = politica['id_repuesto'].max()
+    extra = pd.DataFrame({
+        'id_politica': np.arange(1, repuestos + 1),
+        'id_repuesto': np.arange(1, repuestos + 1), 'equipos_min': 0,
+        'equipos_max': pd.array([pd.NA] * repuestos, dtype='Int64'),
+        'stock_minimo': np.random.default_rng(1).integers(10, 20, repuestos),
+    })
+    politica = politica.assign(id_politica=np.arange(len(politica)) + repuestos + 1)
+    tablas['politica_stock_repuestos'] = pd.concat([politica, extra], ignore_index=True)
+    base_sintetica(tablas)
+
+    servidor = analisis_en_servidor()
+
+    comparar(servidor, app._analisis_stock_pandas())
+    # Cada repuesto toma la banda extra (de 10 a 19) en cada uno de sus modelos
+    assert (servidor['stock_minimo_total'] >= 10).all()
+
+
+def test_paridad_con_inventario_en_varias_filas(base_sintetica):
+    tablas = benchmark.generar_datos_sinteticos(1_000, semilla=2)
+    # La mitad de los repuestos con stock tiene una segunda fila (otra bodega): cuenta la suma
+    inventario = tablas['inventario_logistico']
+    segunda = inventario.sample(frac=0.5, random_state=2).assign(stock_actual=lambda df: df['stock_actual'] + 3)
+    tablas['inventario_logistico'] = pd.concat([inventario, segunda], ignore_index=True)
+    base_sintetica(tablas)
+
+    servidor = analisis_en_servidor()
+
+    comparar(servidor, app._analisis_stock_pandas())
+    assert servidor['id_repuesto'].is_unique
+    esperado = tablas['inventario_logistico'].groupby('id_repuesto')['stock_actual'].sum()
+    con_stock = servidor[servidor['id_repuesto'].isin(esperado.index)]
+    assert (con_stock['stock_actual'].to_numpy() == esperado[con_stock['id_repuesto']].to_numpy()).all()
@@ -0,0 +1,34 @@
+"""Exportaciones por bloques: cada bloque tiene que caber en el esquema del primero."""
+from decimal import Decimal
+from io import BytesIO
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from app import to_parquet
+
+
+def test_parquet_con_decimales_de_distinta_escala():
+    # Como el costo técnico del historial de costos: NUMERIC cuya escala cambia entre bloques
+    bloques = [
+        pd.DataFrame({'id_servicio': [1, 2], 'costo_tecnico': [Decimal('1.5'), Decimal('20.25')]}),
+        pd.DataFrame({'id_servicio': [3, 4], 'costo_tecnico': [Decimal('3.123456789'), None]}),
+        pd.DataFrame({'id_servicio': [5], 'costo_tecnico': [Decimal('4')]}),
+    ]
+
+    leido = pq.read_table(BytesIO(to_parquet({"Costos": iter(bloques)}))).to_pandas()
+
+    assert leido['id_servicio'].tolist() == [1, 2, 3, 4, 5]
+    assert leido['costo_tecnico'].dtype == 'float64'
+    pd.testing.assert_series_equal(
+        leido['costo_tecnico'],
+        pd.Series([1.5, 20.25, 3.123456789, None, 4.0], name='costo_tecnico', dtype='float64'),
+    )
+
+
+def test_parquet_de_un_dataframe_completo():
+    df = pd.DataFrame({'descripcion': ["Filtro", "Correa"], 'deficit': [2.0, 0.0]})
+
+    leido = pq.read_table(BytesIO(to_parquet({"Stock": df}))).to_pandas()
+
+    pd.testing.assert_frame_equal(leido, df)
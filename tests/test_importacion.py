@@ -0,0 +1,38 @@
+"""Validación de archivos de importación masiva contra los datos maestros."""
+import pandas as pd
+
+from app import validar_importacion
+
+
+def maestros():
+    """Datos maestros mínimos con la forma que devuelve cargar_datos_maestros."""
+    return (
+        pd.DataFrame({'id_tecnico': [1]}),
+        pd.DataFrame({'id_equipo': [1]}),
+        pd.DataFrame({'id_repuesto': [1, 2, 3, 4]}),
+        pd.DataFrame({'id_contrato': [], 'id_cliente': []}),
+        {'cliente_por_equipo': {1: 1}},
+    )
+
+
+def test_consumo_con_cantidad_menor_que_uno_se_rechaza():
+    archivo = pd.DataFrame({'id_servicio': [10, 10, 10, 10], 'id_repuesto': [1, 2, 3, 4],
+                            'cantidad': [0, -2, 1, "3"]})
+
+    validas, errores = validar_importacion(archivo, "Consumo de repuestos", maestros())
+
+    assert errores.to_dict('records') == [
+        {'fila': 2, 'error': "'cantidad' debe ser al menos 1"},
+        {'fila': 3, 'error': "'cantidad' debe ser al menos 1"},
+    ]
+    assert validas['cantidad'].tolist() == [1, 3]
+
+
+def test_gastos_aceptan_cero_pero_no_importes_negativos():
+    archivo = pd.DataFrame({'fecha': ["2024-05-02", "2024-05-03"], 'id_tecnico': [1, 1],
+                            'parqueo': [0, 0], 'hospedaje': [0, -5]})
+
+    validas, errores = validar_importacion(archivo, "Gastos diarios", maestros())
+
+    assert errores.to_dict('records') == [{'fila': 3, 'error': "'hospedaje' no puede ser negativo"}]
+    assert validas['fila'].tolist() == [2]
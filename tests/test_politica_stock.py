@@ -0,0 +1,101 @@
+"""Paridad de aplicar_politica_stock con el recorrido fila por fila al que reemplazó."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import aplicar_politica_stock
+
+COLUMNAS = ['id_repuesto', 'id_modelo', 'stock_minimo', 'total_equipos']
+
+
+def politica_fila_por_fila(compat_instalada, df_pol):
+    """El cálculo original de cargar_analisis_stock, tal cual: iterrows() y un filtro por fila."""
+    politica_aplicada = []
+    for _, row in compat_instalada.iterrows():
+        repuesto_id = row['id_repuesto']
+        modelo_id = row['id_modelo']
+        total_equipos = row['total_equipos']
+        
+        pol_filtro = df_pol[df_pol['id_repuesto'] == repuesto_id].copy()
+        pol_aplicable = pol_filtro[
+            (pol_filtro['equipos_min'] <= total_equipos) & 
+            (pol_filtro['equipos_max'].isna() | (pol_filtro['equipos_max'] >= total_equipos))
+        ]
+        if not pol_aplicable.empty:
+            stock_req = pol_aplicable.iloc[0]['stock_minimo']
+            politica_aplicada.append({
+                'id_repuesto': repuesto_id,
+                'id_modelo': modelo_id,
+                'stock_minimo': stock_req,
+                'total_equipos': total_equipos
+            })
+    return pd.DataFrame(politica_aplicada, columns=COLUMNAS)
+
+
+def catalogo_sintetico(filas, semilla=0):
+    """(compat_instalada, df_pol) con `filas` pares (repuesto, modelo) y bandas de política variadas.
+
+    Hay repuestos sin política, bandas solapadas (gana la primera en el orden de la tabla),
+    huecos entre bandas y bandas abiertas (equipos_max nulo), y la tabla de política viene
+    desordenada, como puede devolverla la base de datos.
+    """
+    rng = np.random.default_rng(semilla)
+    n_rep = filas // 20
+    n_mod = 400
+    pares = pd.DataFrame({
+        'id_repuesto': rng.integers(1, n_rep + 1, filas * 2),
+        'id_modelo': rng.integers(1, n_mod + 1, filas * 2),
+    }).drop_duplicates(ignore_index=True).head(filas)
+    total_equipos = pd.Series(rng.integers(1, 300, n_mod + 1))
+    compat_instalada = pares.assign(total_equipos=total_equipos[pares['id_modelo']].to_numpy())
+    
+    con_politica = rng.choice(np.arange(1, n_rep + 1), int(n_rep * 0.9), replace=False)
+    bandas = rng.integers(1, 5, len(con_politica))
+    id_repuesto = np.repeat(con_politica, bandas)
+    minimo = rng.integers(0, 250, len(id_repuesto))
+    maximo = (minimo + rng.integers(0, 120, len(id_repuesto))).astype(float)
+    maximo[rng.random(len(id_repuesto)) < 0.25] = np.nan
+    df_pol = pd.DataFrame({
+        'id_politica': np.arange(1, len(id_repuesto) + 1), 'id_repuesto': id_repuesto,
+        'equipos_min': minimo, 'equipos_max': maximo,
+        'stock_minimo': rng.integers(1, 10, len(id_repuesto)),
+    }).sample(frac=1, random_state=semilla, ignore_index=True)
+    return compat_instalada, df_pol
+
+
+def test_paridad_con_el_recorrido_fila_por_fila_en_100k_filas():
+    compat_instalada, df_pol = catalogo_sintetico(100_000)
+    assert len(compat_instalada) == 100_000
+    
+    esperado = politica_fila_por_fila(compat_instalada, df_pol)
+    obtenido = aplicar_politica_stock(compat_instalada, df_pol)
+    
+    assert len(esperado) > 0
+    pd.testing.assert_frame_equal(obtenido, esperado, check_dtype=False)
+
+
+@pytest.mark.parametrize("vacio", ['compat_instalada', 'df_pol'])
+def test_entradas_vacias(vacio):
+    compat_instalada, df_pol = catalogo_sintetico(200)
+    entradas = {'compat_instalada': compat_instalada, 'df_pol': df_pol}
+    entradas[vacio] = entradas[vacio].iloc[0:0]
+    
+    obtenido = aplicar_politica_stock(**entradas)
+    
+    assert obtenido.empty
+    assert list(obtenido.columns) == COLUMNAS
+
+
+def test_banda_abierta_y_primera_politica_aplicable():
+    compat_instalada = pd.DataFrame({'id_repuesto': [1, 1, 2], 'id_modelo': [10, 11, 10],
+                                     'total_equipos': [5, 500, 5]})
+    df_pol = pd.DataFrame({'id_repuesto': [1, 1, 1], 'equipos_min': [0, 0, 100],
+                           'equipos_max': [10, 20, np.nan], 'stock_minimo': [3, 7, 9]})
+    
+    obtenido = aplicar_politica_stock(compat_instalada, df_pol)
+    
+    # El repuesto 2 no tiene política; con 5 equipos gana la primera banda aunque la segunda también aplica
+    assert obtenido.to_dict('records') == [
+        {'id_repuesto': 1, 'id_modelo': 10, 'stock_minimo': 3, 'total_equipos': 5},
+        {'id_repuesto': 1, 'id_modelo': 11, 'stock_minimo': 9, 'total_equipos': 500},
+    ]
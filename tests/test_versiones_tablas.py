@@ -0,0 +1,86 @@
+"""Invalidación de cachés por versión de tabla, también en los reruns de un fragmento.
+
+Necesita una base de datos PostgreSQL desechable en TEST_DB_URL (solo usa la tabla
+versiones_tablas). Sin TEST_DB_URL los tests se saltan.
+"""
+import os
+
+import pytest
+
+import app
+import benchmark
+
+TEST_DB_URL = os.environ.get('TEST_DB_URL')
+pytestmark = pytest.mark.skipif(not TEST_DB_URL, reason="fija TEST_DB_URL con una base de datos desechable")
+
+
+class CargaFalsa:
+    """Ocupa el lugar de una carga cacheada y anota si se limpió su caché."""
+    def __init__(self):
+        self.limpiada = False
+
+    def clear(self):
+        self.limpiada = True
+
+
+@pytest.fixture
+def cargas(monkeypatch):
+    """Apunta la app a TEST_DB_URL con las cachés de versiones vacías y cargas falsas."""
+    if benchmark.es_produccion(TEST_DB_URL):
+        pytest.fail("TEST_DB_URL apunta a la base de datos de producción")
+    monkeypatch.setattr(app, 'engine', app.crear_engine(TEST_DB_URL))
+    for cache in (app.preparar_versiones_tablas, app.leer_versiones_tablas, app._versiones_vistas):
+        cache.clear()
+    falsas = {carga: CargaFalsa() for carga in app.TABLAS_POR_CARGA}
+    for carga, falsa in falsas.items():
+        monkeypatch.setattr(app, carga, falsa)
+    yield falsas
+    for cache in (app.preparar_versiones_tablas, app.leer_versiones_tablas, app._versiones_vistas):
+        cache.clear()
+    app.engine.dispose()
+
+
+def escribir(tablas):
+    """Como una escritura de la app: incrementa las versiones y avisa."""
+    with app.engine.begin() as conn:
+        app.incrementar_versiones(conn, tablas)
+    app.avisar_escritura()
+
+
+def test_solo_se_limpian_las_cargas_de_las_tablas_cambiadas(cargas):
+    app.sincronizar_caches()
+    escribir(['inventario_logistico'])
+
+    app.sincronizar_caches()
+
+    limpiadas = {carga for carga, falsa in cargas.items() if falsa.limpiada}
+    assert limpiadas == {carga for carga, tablas in app.TABLAS_POR_CARGA.items()
+                         if 'inventario_logistico' in tablas}
+    assert 'cargar_analisis_stock' in limpiadas
+    assert 'cargar_indicadores_equipos' not in limpiadas
+
+
+def test_sin_cambios_no_se_limpia_nada(cargas):
+    app.sincronizar_caches()
+
+    app.sincronizar_caches()
+
+    assert not any(falsa.limpiada for falsa in cargas.values())
+
+
+def test_el_rerun_de_una_seccion_sincroniza_antes_de_dibujar(cargas):
+    dibujada = []
+
+    @app.fragmento_seccion
+    def seccion_prueba():
+        dibujada.append(cargas['cargar_analisis_stock'].limpiada)
+
+    # Fuera de Streamlit el fragmento no se ejecuta: __wrapped__ es lo que corre en su rerun,
+    # sin pasar por interfaz()
+    rerun_del_fragmento = seccion_prueba.__wrapped__
+    rerun_del_fragmento()
+    escribir(['politica_stock_repuestos'])
+
+    rerun_del_fragmento()
+
+    assert dibujada == [False, True]